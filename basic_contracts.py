@@ -8,12 +8,26 @@ Basic contracts for general usage:
   - not empty: fails if the parameter is not a container, or the container is empty
   - sorted: fails if the parameter is not a container (or a string!) or its content is not sorted.
 
+And some basic contract families, taking arguments:
+  - int(min,max), number(min,max): fails if the parameter is not an int (or a number), between min and max included
+  - len(<=n): fails if the length of the parameter is not <= n (also <, >, >=, ==, !=, or just n for ==); len(min,max)
+    fails if it is not between min and max included
+  - one_of(a,b,...): fails if the parameter is not one of the arguments (hashable)
+
+Type contracts are defined by their types, so that '|' chains of them are checked with a single lookup of the type of
+the parameter. They have also a vectorized form, used for buffers (array.array, memoryview, numpy arrays) in '[...]'
+assertions; 'sorted' is checked with a single vectorized operation on one-dimensional numpy arrays.
+
 See unit tests for more details about the contract meanings.
 """
 
+import re
+import sys
+import operator
+from array import array
 from datetime import datetime, date
 from numbers import Number
-from contracts import new_contract
+from contracts import new_contract, new_contract_family
 from itertools import tee
 
 try:
@@ -33,28 +47,124 @@ def pairwise(iterable):
     return izip(a, b)
 
 
+_MEMORYVIEW_ITEM_TYPES = dict([('?', bool), ('c', bytes)] + [(code, float) for code in 'efd'] +
+                              [(code, int) for code in 'bBhHiIlLqQnNP'])
+
+
+def item_type(buffer):
+    """
+    The type of all the items of a one-dimensional buffer (array.array, memoryview or numpy array), or None if unknown
+    """
+    if isinstance(buffer, array):
+        return str if buffer.typecode in 'uw' else float if buffer.typecode in 'fd' else int
+    if isinstance(buffer, memoryview):
+        return _MEMORYVIEW_ITEM_TYPES.get(buffer.format.lstrip('@=<>!')) if buffer.ndim == 1 else None
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(buffer, numpy.ndarray) and buffer.ndim == 1 and buffer.dtype.kind != 'O':
+        return buffer.dtype.type
+    return None
+
+
+def vectorized_isinstance(*types):
+    """
+    Vectorized form of a contract checking that the parameter is an instance of one of types
+    """
+    def check_buffer(buffer):
+        buffer_item_type = item_type(buffer)
+        if buffer_item_type is None:
+            return None
+        return len(buffer) == 0 or issubclass(buffer_item_type, types)
+    return check_buffer
+
+
+def is_sorted(l):
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(l, numpy.ndarray) and l.ndim == 1:
+        return bool((l[:-1] <= l[1:]).all())
+    return all((x <= y for x, y in pairwise(l)))
+
+
+def range_family(*types):
+    """
+    Family of contracts checking that the parameter is an instance of one of types, between min and max included
+    """
+    def family(minimum, maximum):
+        if minimum > maximum:
+            raise ValueError('empty range %r..%r' % (minimum, maximum))
+
+        def check_range(x):
+            return isinstance(x, types) and not isinstance(x, bool) and minimum <= x <= maximum
+        return check_range
+    return family
+
+
+_LENGTH_PATTERN = re.compile(r'^\s*(<=|>=|==|!=|<|>)?\s*(\d+)\s*$')
+
+_LENGTH_OPERATORS = {'<=': operator.le, '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+                     '<': operator.lt, '>': operator.gt, None: operator.eq}
+
+
+def length_family(bound, maximum=None):
+    """
+    Family of contracts on the length of the parameter: len(<=n), len(n) or len(min,max)
+    """
+    if maximum is not None:
+        return lambda x: bound <= len(x) <= maximum
+    match = _LENGTH_PATTERN.match(str(bound))
+    if match is None:
+        raise ValueError('invalid length %r' % (bound,))
+    compare, length = _LENGTH_OPERATORS[match.group(1)], int(match.group(2))
+    return lambda x: compare(len(x), length)
+
+
+def one_of_family(*values):
+    """
+    Family of contracts checking that the parameter is one of values
+    """
+    allowed = frozenset(values)
+
+    def check_one_of(x):
+        try:
+            return x in allowed
+        except TypeError:  # unhashable
+            return False
+    return check_one_of
+
+
+def new_type_contract(name, *types):
+    """
+    Define a contract checking that the parameter is an instance of one of types, with its vectorized form
+    """
+    new_contract(name, vectorized=vectorized_isinstance(*types), types=types)
+
+
 def setup():
     # Empty
-    new_contract('None', lambda x: x is None)
-    new_contract('not None', lambda x: x is not None)
+    new_type_contract('None', type(None))
+    new_contract('not None', lambda x: x is not None, vectorized_isinstance(object))
     new_contract('not empty', lambda x: len(x) > 0)
     # Basic types
-    new_contract('bool', lambda x: isinstance(x, bool))
-    new_contract('number', lambda x: isinstance(x, Number))
-    new_contract('string', lambda x: isinstance(x, str))
+    new_type_contract('bool', bool)
+    new_type_contract('number', Number)
+    new_type_contract('string', str)
     new_contract('string with text', lambda x: isinstance(x, str) and len(x.strip()) > 0)
     # Date/time
-    new_contract('date', lambda dt: isinstance(dt, date))
-    new_contract('datetime', lambda dt: isinstance(dt, datetime))
+    new_type_contract('date', date)
+    new_type_contract('datetime', datetime)
     try:
         # IronPython-specific contracts
         # noinspection PyUnresolvedReferences
         from System import DateTime
         new_contract('any date',
                      lambda d: isinstance(d, date) or (isinstance(d, DateTime) and d.Hour == d.Minute == d.Second == 0))
-        new_contract('any datetime', lambda dt: isinstance(dt, datetime) or isinstance(dt, DateTime))
+        new_contract('any datetime', types=(datetime, DateTime))
     except ImportError:
-        new_contract('any date', lambda dt: isinstance(dt, date))
-        new_contract('any datetime', lambda dt: isinstance(dt, datetime))
+        new_contract('any date', types=date)
+        new_contract('any datetime', types=datetime)
     # Others
-    new_contract('sorted', lambda l: all((x <= y for x, y in pairwise(l))))
+    new_contract('sorted', is_sorted)
+    # Families
+    new_contract_family('int', range_family(int))
+    new_contract_family('number', range_family(Number))
+    new_contract_family('len', length_family)
+    new_contract_family('one_of', one_of_family)
@@ -1,8 +1,14 @@
+from array import array
 from datetime import date, datetime
-from unittest import TestCase
-from contracts import contract, ContractError
+from unittest import TestCase, skipIf
+from contracts import contract, ContractError, ContractParseError, parse_assertion
 import basic_contracts
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 # noinspection PyUnusedLocal
 class BasicTests(TestCase):
@@ -101,3 +107,61 @@ class BasicTests(TestCase):
         self.assertRaises(ContractError, t_any_datetime, [1])
         self.assertRaises(ContractError, t_any_datetime, date.today())
         t_any_datetime(datetime.now())
+
+    def test_families(self):
+        @contract(a='int(0,100)', b='len(<=3)', c='one_of(red,green)', d='[number(-1.5,1.5)]', e='len(1,2)|None')
+        def t_families(a, b='', c='red', d=(), e=None):
+            pass
+        t_families(0, 'abc', 'green', [1.5, -1], [1, 2])
+        t_families(100)
+        self.assertRaises(ContractError, t_families, 101)
+        self.assertRaises(ContractError, t_families, 1.0)
+        self.assertRaises(ContractError, t_families, True)
+        self.assertRaises(ContractError, t_families, 1, 'abcd')
+        self.assertRaises(ContractError, t_families, 1, c='blue')
+        self.assertRaises(ContractError, t_families, 1, c=[])
+        self.assertRaises(ContractError, t_families, 1, d=[2])
+        self.assertRaises(ContractError, t_families, 1, e=[])
+        self.assertRaises(ContractParseError, contract, a='int(10,0)')
+        self.assertRaises(ContractParseError, contract, a='len(<>3)')
+
+
+class VectorizedTests(TestCase):
+
+    def setUp(self):
+        basic_contracts.setup()
+
+    def assertSameAsItems(self, assertion, buffer, expected):
+        self.assertEqual(parse_assertion(assertion).check(buffer), expected)
+        self.assertEqual(parse_assertion(assertion).check(list(buffer)), expected)
+
+    def test_array(self):
+        self.assertSameAsItems('[number]', array('i', [1, 2, 3]), True)
+        self.assertSameAsItems('[number]', array('d', [1.5]), True)
+        self.assertSameAsItems('[number]', array('u', 'ab'), False)
+        self.assertSameAsItems('[string]', array('u', 'ab'), True)
+        self.assertSameAsItems('[bool]', array('i', [1]), False)
+        self.assertSameAsItems('[bool]', array('i'), True)
+        self.assertSameAsItems('[None]', array('i', [1]), False)
+        self.assertSameAsItems('[not None]', array('i', [1]), True)
+
+    def test_memoryview(self):
+        self.assertSameAsItems('[number]', memoryview(b'abc'), True)
+        self.assertSameAsItems('[number]', memoryview(b'abc').cast('c'), False)
+        self.assertSameAsItems('[bool]', memoryview(b'\x00\x01').cast('?'), True)
+        self.assertSameAsItems('[number]', memoryview(array('d', [1.0])), True)
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy(self):
+        self.assertTrue(parse_assertion('[number]').check(numpy.arange(10)))
+        self.assertTrue(parse_assertion('[number]').check(numpy.zeros(10, dtype=numpy.complex128)))
+        self.assertFalse(parse_assertion('[number]').check(numpy.array(['a', 'b'])))
+        self.assertTrue(parse_assertion('[string]').check(numpy.array(['a', 'b'])))
+        self.assertFalse(parse_assertion('[bool]').check(numpy.array([True])))
+        self.assertTrue(parse_assertion('[number]').check(numpy.array([1, 2.5], dtype=object)))
+        self.assertFalse(parse_assertion('[number]').check(numpy.array([1, 'a'], dtype=object)))
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_sorted(self):
+        self.assertTrue(parse_assertion('sorted').check(numpy.arange(10)))
+        self.assertFalse(parse_assertion('sorted').check(numpy.arange(10)[::-1]))
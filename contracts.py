@@ -4,8 +4,11 @@ Small module to allow some DBC in python.
 Contracts can specify assertions on parameters, on relations between parameters, and the return value.
 Assertions on parameters and return value are boolean functions that must be registered before the contract evaluation.
 Assertions on relations between parameters instead are just any python expression.
-Contracts can be turned off, for instance to improve performance on a final release. Note that there are no performance
-tests now about the impact of the contracts, in both cases (enabled and disabled).
+Contracts can be turned off, for instance to improve performance on a final release. The impact of the contracts, in
+both cases (enabled and disabled), is measured by the benchmarks in contracts_benchmark.
+Setting contracts.enabled swaps the wrappers of all decorated functions at runtime; setting contracts.stripped (or the
+environment variable SIMPLE_CONTRACTS_STRIP) before import leaves the decorated functions unchanged. A policy (see
+set_policy) can turn contracts off, or check them partially, for single modules or functions.
 
 Usage:
 
@@ -23,7 +26,8 @@ Assertion syntax:
   4. They can also be preceded by 'name:' to state that the assertion is on a member
   5. It is possible to nest the two points before in any way
   6. Several assertions can be chained with ',', meaning they need all to be satisfied
-  7. As well, '|' can be used to state alternative paths. This can't be used together with ','.
+  7. As well, '|' can be used to state alternative paths. ',' binds tighter than '|', and parentheses can be used
+     to group assertions.
 
 Example assertions:
   - p='positive int'                                p satisfies contract 'positive int'
@@ -39,62 +43,1584 @@ Example assertions:
   - p='positive int|negative int'                   p satisfies any of contracts 'positive int' and 'negative int'
 """
 
+import os
 import re
+import ast
+import sys
+import fnmatch
+import types
+import json
+import math
+import atexit
+import marshal
+import hashlib
 import inspect
-import collections
+import logging
+import tempfile
+import weakref
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from itertools import chain, islice
+from random import random
 
-from decorator import decorator
+try:
+    from time import perf_counter as _clock
+except ImportError:
+    from time import time as _clock
+
+try:
+    import builtins
+except ImportError:
+    # noinspection PyUnresolvedReferences
+    import __builtin__ as builtins
+
+from decorator import FunctionMaker
+
+try:
+    from collections.abc import Iterator, Mapping, Sequence
+except ImportError:
+    from collections import Iterator, Mapping, Sequence
+
+try:
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+except ImportError:
+    # Python 2 without the futures backport: items are checked serially
+    ThreadPoolExecutor = ProcessPoolExecutor = as_completed = None
+
+try:
+    from collections.abc import AsyncIterator
+    from contracts_async import checked_coroutine, checked_async_items, checked_invariants
+except (ImportError, SyntaxError):
+    AsyncIterator = checked_coroutine = checked_async_items = checked_invariants = None
 
 
 def contract(**assertion_list):
+    if stripped:
+        return _unchanged
+    is_lazy = assertion_list.pop('_lazy', lazy)
+    sampling_policy = _sampling_policy(assertion_list.pop('_sample', sampling))
+    validator = _deferred_validator(assertion_list.pop('_deferred', None))
     # Create the assertion list...
+    parsed_assertions = None if is_lazy else _parse_assertion_list(assertion_list)
+
+    def _decorate(f):
+        contracted = _ContractedFunction(f, assertion_list, sampling_policy, validator)
+        if parsed_assertions is not None:
+            contracted.prepare(parsed_assertions)
+        wrapper = _make_wrapper(f, contracted.checked_call)
+        contracted.attach(wrapper)
+        return wrapper
+
+    return _decorate
+
+
+def warm_up(raise_errors=True):
+    """
+    Parse and compile all the contracts still pending because of lazy mode.
+    Parse errors are collected for all the functions (and the invariants of classes), and raised together (as a single
+    ContractParseError), or returned as a list of (function or class, error) pairs.
+    """
+    errors = []
+    for contracted in list(_contracted_functions):
+        if contracted.pending:
+            try:
+                contracted.prepare()
+                contracted.install()
+            except ContractParseError as e:
+                errors.append((contracted.function, e))
+    for class_contract in list(_class_contracts):
+        if class_contract.pending:
+            try:
+                class_contract.prepare()
+            except ContractParseError as e:
+                errors.append((class_contract.owner, e))
+    if errors and raise_errors:
+        raise ContractParseError('\n'.join('%s: %s' % (_qualified_name(f), e) for f, e in errors))
+    return errors
+
+
+def contract_class(_invariants=(), _methods=None, **assertion_list):
+    """
+    Class decorator: the assertions of assertion_list apply to the parameters with the same names in all the public
+    methods (and __init__); _methods gives further contracts by method name, including _returns and _constraint.
+    Invariants are assertions on the instance (e.g. 'count:positive int'), checked after __init__ and after the public
+    methods; only the invariants on the members that could have changed during the call are checked again (invariants
+    not made just of 'member:' assertions are always checked).
+    Subclasses inherit the contracts and invariants, also on the methods they define; decorating them adds more.
+    """
+    if stripped:
+        return _unchanged
+    for reserved in ('_returns', '_constraint'):
+        if reserved in assertion_list:
+            raise ContractParseError('%s can only be given per method, in _methods' % reserved)
+
+    def _decorate(cls):
+        inherited = getattr(cls, '__class_contract__', None)
+        _ClassContract(assertion_list, _invariants, _methods or {}, inherited).apply(cls)
+        return cls
+
+    return _decorate
+
+
+class _ClassContract(object):
+    """
+    The contracts of a class (and of its subclasses, unless decorated in turn). Assertions are parsed once, and their
+    compiled checks are shared by all the methods using them.
+    """
+    def __init__(self, assertion_list, invariants, methods, inherited=None):
+        self.assertion_list = dict(inherited.assertion_list if inherited is not None else {}, **assertion_list)
+        self.methods = dict(inherited.methods) if inherited is not None else {}
+        for name, method_assertions in methods.items():
+            self.methods[name] = dict(self.methods.get(name, {}), **method_assertions)
+        self.invariants = list(inherited.invariants if inherited is not None else []) + list(invariants)
+        self.contract_names = frozenset()
+        self.always = []  # (text, check) of the invariants to check after every call
+        self.by_member = {}  # member name -> [(text, check)] of the invariants using it
+        self.wrappers = []  # _InvariantsWrapper of the methods checking invariants
+        self.owner = None  # the decorated class, for errors
+        self.pending = True
+        if not lazy:
+            self.prepare()
+        _class_contracts.add(self)
+
+    def prepare(self):
+        """
+        Parse and compile the invariants: at decoration time, or in lazy mode on the first checked call
+        """
+        self.refresh()
+        self.pending = False
+        self.install()
+
+    def refresh(self):
+        """
+        Parse and compile again the invariants, after some of the contracts they use have been redefined (or a change
+        of the global options)
+        """
+        contract_names = frozenset()
+        always = []
+        by_member = {}
+        for text in self.invariants:
+            parsed = parse_assertion(text)
+            contract_names |= parsed.contract_names
+            members = _invariant_members(parsed)
+            if members is None:
+                always.append((text, parsed.compiled))
+            for member in members or ():
+                by_member.setdefault(member, []).append((text, parsed.compiled))
+        self.contract_names = contract_names
+        self.always, self.by_member = always, by_member
+
+    def apply(self, cls):
+        if self.owner is None:
+            self.owner = cls
+        type.__setattr__(cls, '__class_contract__', self)
+        for name, member in list(cls.__dict__.items()):
+            function = getattr(member, '__contract_method__', member)
+            if not isinstance(function, types.FunctionType):
+                continue
+            if name.startswith('_') and name != '__init__' and name not in self.methods:
+                continue
+            wrapper = self.wrap(name, function)
+            if wrapper is not function:
+                type.__setattr__(cls, name, wrapper)
+        if hasattr(object, '__init_subclass__') and '__init_subclass__' not in cls.__dict__:
+            def __init_subclass__(subclass, **kwargs):
+                super(cls, subclass).__init_subclass__(**kwargs)
+                if subclass.__dict__.get('__class_contract__') is None:
+                    # The contract of the nearest base, looked up now: bases may have been decorated again
+                    subclass.__class_contract__.apply(subclass)
+            type.__setattr__(cls, '__init_subclass__', classmethod(__init_subclass__))
+
+    def wrap(self, name, function):
+        parameter_names = _parameter_names(function)
+        method_assertions = dict((param, assertion) for param, assertion in self.assertion_list.items()
+                                 if param in parameter_names)
+        method_assertions.update(self.methods.get(name, {}))
+        wrapper = contract(**method_assertions)(function) if method_assertions else function
+        if self.invariants and (name == '__init__' or not name.startswith('_')):
+            wrapper = self._wrap_invariants(name, function, wrapper)
+        if wrapper is not function:
+            wrapper.__contract_method__ = function
+        return wrapper
+
+    def _wrap_invariants(self, name, function, method):
+        checking_call = self._invariants_call(name, function, method, True)
+        unchecked_call = self._invariants_call(name, function, method, False)
+        wrapper = _make_wrapper(function, checking_call)
+        self.wrappers.append(_InvariantsWrapper(wrapper.__globals__, function, method, checking_call, unchecked_call))
+        self.install()
+        return wrapper
+
+    def _invariants_call(self, name, function, method, checked):
+        """
+        The call of method checking the invariants after it or, if not checked (for the calls not sampled), just
+        marking the instance as in a call, so that nested calls on it don't check them either
+        """
+        snapshot = self.snapshot if checked and name != '__init__' else None
+        check_invariants = self.check_invariants if checked else None
+
+        if _is_coroutine_function(function):
+            # The body runs when the coroutine is awaited: invariants are checked after that
+            def check_after_await(instance, before):
+                if check_invariants is not None:
+                    check_invariants(instance, before, name)
+
+            def call_checking_invariants(instance, *args, **kwargs):
+                return checked_invariants(method, instance, args, kwargs, snapshot, check_after_await)
+            return call_checking_invariants
+
+        def call_checking_invariants(instance, *args, **kwargs):
+            calls = _invariant_calls.__dict__.setdefault('calls', set())
+            key = id(instance)
+            if key in calls:
+                # Nested call on the same instance: the outermost one checks the invariants
+                return method(instance, *args, **kwargs)
+            before = snapshot(instance) if snapshot is not None else None
+            calls.add(key)
+            try:
+                ret = method(instance, *args, **kwargs)
+            finally:
+                calls.discard(key)
+            if check_invariants is not None:
+                check_invariants(instance, before, name)
+            return ret
+        return call_checking_invariants
+
+    def resolve_policy(self):
+        for wrapper in self.wrappers:
+            wrapper.mode, wrapper.policy_sampling = _policy_mode(wrapper.function)
+            if wrapper.policy_sampling is not None and wrapper.sampling_stats is None:
+                wrapper.sampling_stats = SamplingStats()
+
+    def install(self):
+        """
+        Like _ContractedFunction.install: the wrappers call whatever is stored as '_call_' in their namespace, either
+        the call checking invariants or directly the method. Invariants are checked after the calls, like _returns, so
+        they are not checked in 'args-only' mode (nor in 'off' mode); in 'sampled' mode they are checked on the calls
+        sampled by the policy.
+        """
+        for wrapper in self.wrappers:
+            if not _enabled or wrapper.mode in ('off', 'args-only'):
+                wrapper.namespace['_call_'] = wrapper.method
+                continue
+            checking_call = wrapper.checking_call if not self.pending else self._first_call(wrapper.checking_call)
+            if wrapper.mode == 'sampled':
+                checking_call = wrapper.policy_sampling.wrap(
+                    _SampledCall(wrapper.unchecked_call, checking_call, wrapper.sampling_stats))
+            wrapper.namespace['_call_'] = checking_call
+
+    def _first_call(self, checking_call):
+        def first_call(*args, **kwargs):
+            self.prepare()
+            return checking_call(*args, **kwargs)
+        return first_call
+
+    def snapshot(self, instance):
+        """
+        The values of the members used by the invariants, before a call: None if they are not in the instance __dict__
+        (e.g. with __slots__), and then all the invariants are checked after the call
+        """
+        values = getattr(instance, '__dict__', None)
+        if values is None or not self.by_member:
+            return None
+        return [(member, values.get(member, _absent)) for member in self.by_member]
+
+    def check_invariants(self, instance, before=None, method_name=None):
+        """
+        Check the invariants on the members that could have changed since the snapshot before, and those to check
+        always; all of them if before is None. Members could have changed if they were assigned (or deleted), if their
+        value is mutable, or if they are not in the instance __dict__ (e.g. properties).
+        """
+        if before is None:
+            invariants = self.always + [i for member in sorted(self.by_member) for i in self.by_member[member]]
+        else:
+            values = instance.__dict__
+            changed = [member for member, value in before if _may_have_changed(values.get(member, _absent), value)]
+            invariants = self.always + [i for member in changed for i in self.by_member.get(member, ())]
+        checked = set()
+        for text, check in invariants:
+            if text in checked:
+                continue
+            checked.add(text)
+            if not check(instance):
+                raise ContractError("Broken invariant '%s' of class %s%s" % (
+                    text, type(instance).__name__, ' after %s' % method_name if method_name else ''))
+
+
+class _InvariantsWrapper(object):
+    """
+    A method checking invariants: its wrapper calls whatever is stored as '_call_' in namespace, with the mode of the
+    method in the policy
+    """
+    def __init__(self, namespace, function, method, checking_call, unchecked_call):
+        self.namespace = namespace
+        self.function = function
+        self.method = method
+        self.checking_call = checking_call
+        self.unchecked_call = unchecked_call
+        self.mode, self.policy_sampling = _policy_mode(function)
+        self.sampling_stats = SamplingStats() if self.policy_sampling is not None else None
+
+
+class _SampledCall(object):
+    """
+    What a sampling policy wraps (like a _ContractedFunction): the call when not sampled, and when sampled
+    """
+    def __init__(self, function, checked_call, sampling_stats):
+        self.function = function
+        self.checked_call = checked_call
+        self.sampling_stats = sampling_stats
+
+
+def _invariant_members(parsed):
+    """
+    The members an invariant depends on, or None if it depends on the whole instance
+    """
+    if isinstance(parsed, MemberAssertion):
+        return set([parsed.member_name])
+    if isinstance(parsed, ContractAssertion):
+        members = set()
+        for assertion in parsed.assertions:
+            assertion_members = _invariant_members(assertion)
+            if assertion_members is None:
+                return None
+            members |= assertion_members
+        return members
+    return None
+
+
+def _may_have_changed(value, before):
+    return value is not before or value is _absent or _cache_key(value) is None
+
+
+def _parse_assertion_list(assertion_list):
     parameter_assertions = {}  # param_name -> ContractAssertion
     constraint = None
     returns = None
     for param_name in assertion_list.keys():
         if param_name == '_constraint':
-            constraint = assertion_list[param_name]
+            constraint = _parse_constraint(assertion_list[param_name])
         elif param_name == '_returns':
             returns = parse_assertion(assertion_list[param_name])
         else:
             parameter_assertions[param_name] = parse_assertion(assertion_list[param_name])
+    return parameter_assertions, constraint, returns
 
-    def _contract(f, *args, **kwargs):
-        global enabled
-        if not enabled:
-            return f(*args, **kwargs)
-        # retrieve all parameters
-        bound_parameters = inspect.getcallargs(f, *args, **kwargs)
-        # bound: {'a': 1, 'b': 2}
-        for param in bound_parameters.keys():
-            if param in parameter_assertions.keys() and not parameter_assertions[param].check(bound_parameters[param]):
-                # noinspection PyBroadException
+
+class _ContractedFunction(object):
+    """
+    Runtime state of a decorated function. The wrapper calls whatever is stored as '_call_' in its own namespace:
+    either the checked call, or directly the original function when contracts are disabled.
+    In lazy mode, the checked call is first a stub preparing the contract and then replacing itself.
+    In deferred mode, the checked call just captures the calls for a DeferredValidator.
+    The mode given by the policy (None when no rule matches the function) is resolved at decoration time, and again
+    by set_policy or reload_policy.
+    """
+    def __init__(self, function, assertion_list, sampling=None, deferred=None):
+        self.function = function
+        self.assertion_list = assertion_list
+        self.sampling = sampling
+        self.deferred = deferred
+        self.sampling_stats = None
+        self.mode = self.policy_sampling = None
+        self.resolve_policy()
+        self.pending = True
+        self.namespace = None
+        self.contract_names = frozenset()
+        self.checked_call = self._first_call
+        self.check_arguments = self.check_return = self.check_bound_values = None
+        self.bound_names = self.binder = self.positional_names = None
+        self.constraint = self.constraint_check = None
+        self.constraint_arity = 0
+
+    def prepare(self, parsed_assertions=None):
+        parameter_assertions, constraint, returns = parsed_assertions or _parse_assertion_list(self.assertion_list)
+        function = self.function
+        # Bind once, at decoration time, only the parameters that need to be checked
+        parameter_names = _parameter_names(function)
+        constraint_names = []
+        if constraint is not None:
+            constraint_names = constraint.bind_names(parameter_names, function)
+        # Constraint arguments first, so the constraint is called with a prefix of the bound values
+        self.bound_names = constraint_names + [name for name in parameter_names
+                                               if name in parameter_assertions and name not in constraint_names]
+        self.binder = _make_binder(function, self.bound_names)
+        self.positional_names = list(FunctionMaker(function).args)
+        self.constraint = constraint
+        self.constraint_check = constraint.compile(constraint_names) if constraint is not None else None
+        self.constraint_arity = len(constraint_names)
+        self.build(parameter_assertions, returns)
+        self.pending = False
+
+    def _first_call(self, *args, **kwargs):
+        self.prepare()
+        self.install()
+        return self.checked_call(*args, **kwargs)
+
+    def resolve_policy(self):
+        self.mode, self.policy_sampling = _policy_mode(self.function)
+        if self.current_sampling is not None and self.sampling_stats is None:
+            self.sampling_stats = SamplingStats()
+
+    @property
+    def current_sampling(self):
+        if self.mode == 'sampled':
+            return self.policy_sampling
+        return self.sampling if self.mode is None else None
+
+    def build(self, parameter_assertions, returns):
+        assertions = list(parameter_assertions.values()) + ([returns] if returns is not None else [])
+        self.contract_names = frozenset().union(*[assertion.contract_names for assertion in assertions])
+        self.check_arguments = self._make_arguments_check(parameter_assertions)
+        self.check_return = self._make_return_check(returns) if self.mode != 'args-only' else None
+        if self.deferred is not None:
+            self.checked_call = self._make_deferred_call(self.deferred)
+        elif _instrumentation is not None:
+            self.checked_call = self._make_instrumented_call(_instrumentation)
+        else:
+            self.checked_call = self._make_checked_call()
+        if self.current_sampling is not None:
+            self.checked_call = self.current_sampling.wrap(self)
+
+    def refresh(self):
+        """
+        Parse again the assertions, after some of the contracts they use have been redefined
+        """
+        parameter_assertions, _, returns = _parse_assertion_list(self.assertion_list)
+        self.build(parameter_assertions, returns)
+        self.install()
+
+    def attach(self, wrapper):
+        self.namespace = wrapper.__globals__
+        wrapper.__contract__ = self
+        _contracted_functions.add(self)
+        self.install()
+
+    def install(self):
+        self.namespace['_call_'] = self.checked_call if _enabled and self.mode != 'off' else self.function
+
+    def _make_arguments_check(self, parameter_assertions):
+        """
+        The check of the arguments: it raises ContractError, or returns None, or the arguments (args, kwargs) to pass
+        to the function instead, when iterators are replaced by iterators checking their items
+        """
+        f = self.function
+        binder = self.binder
+        constraint = self.constraint
+        constraint_check = self.constraint_check
+        constraint_arity = self.constraint_arity
+        positional_names = self.positional_names
+        checks = [(index, name, parameter_assertions[name].compiled) for index, name in enumerate(self.bound_names)
+                  if name in parameter_assertions]
+        if _instrumentation is not None:
+            qualified_name = _qualified_name(f)
+            checks = [(index, name, _instrumentation.timed(check, _instrumentation.parameter(qualified_name, name)))
+                      for index, name, check in checks]
+            if constraint_check is not None:
+                constraint_check = _instrumentation.timed(constraint_check,
+                                                          _instrumentation.parameter(qualified_name, '_constraint'))
+        # Parameters with a single '[...]' assertion can be iterators, checked item by item while they are consumed
+        item_checks = {}
+        for name, assertion in parameter_assertions.items():
+            if assertion.stream_item_assertion is not None and name in positional_names:
+                item_checks[name] = assertion.stream_item_assertion.compiled
+
+        def check_arguments(*args, **kwargs):
+            bound_values = binder(*args, **kwargs)
+            # bound: (1, 2)
+            replaced = None
+            for index, param, check in checks:
+                if not check(bound_values[index]):
+                    if param in item_checks and isinstance(bound_values[index], Iterator):
+                        if replaced is None:
+                            replaced = list(args), dict(kwargs)
+                        _replace_argument(replaced, param, positional_names.index(param),
+                                          _checked_items(bound_values[index], item_checks[param],
+                                                         'parameter %s' % param, f))
+                        continue
+                    raise ContractError("Broken contract for parameter %s in function %s (got: %s)" % (
+                        param, f.__name__, _describe(bound_values[index])))
+            # Check general constraints
+            if constraint_check is not None and not constraint_check(*bound_values[:constraint_arity]):
+                raise ContractError("Broken contract for general constraint '%s' in function %s" % (constraint.text,
+                                                                                                     f.__name__))
+            return replaced
+
+        def check_bound_values(bound_values):
+            # Deferred mode: the values were bound (and their snapshots taken) by the call; iterators are not checked
+            for index, param, check in checks:
+                if not check(bound_values[index]):
+                    if param in item_checks and isinstance(bound_values[index], Iterator):
+                        continue
+                    raise ContractError("Broken contract for parameter %s in function %s (got: %s)" % (
+                        param, f.__name__, _describe(bound_values[index])))
+            if constraint_check is not None and not constraint_check(*bound_values[:constraint_arity]):
+                raise ContractError("Broken contract for general constraint '%s' in function %s" % (constraint.text,
+                                                                                                     f.__name__))
+        self.check_bound_values = check_bound_values
+        return check_arguments
+
+    def _make_return_check(self, returns):
+        """
+        The check of the return value: it raises ContractError, or returns the value to return (an iterator checking
+        its items, for iterators returned with a single '[...]' assertion)
+        """
+        if returns is None:
+            return None
+        f = self.function
+        check_returns = returns.compiled
+        if _instrumentation is not None:
+            check_returns = _instrumentation.timed(check_returns,
+                                                   _instrumentation.parameter(_qualified_name(f), '_returns'))
+        check_item = returns.stream_item_assertion.compiled if returns.stream_item_assertion is not None else None
+
+        def check_return(ret):
+            if not check_returns(ret):
+                if check_item is not None and isinstance(ret, Iterator):
+                    return _checked_items(ret, check_item, 'return value', f)
+                if check_item is not None and AsyncIterator is not None and isinstance(ret, AsyncIterator):
+                    return checked_async_items(ret, check_item,
+                                               lambda index, item: _item_error(index, item, 'return value', f))
+                raise ContractError('Broken contract for return value of function %s' % f.__name__)
+            return ret
+
+        if _is_coroutine_function(f):
+            # Arguments are checked when the coroutine is created; the return value when it is awaited
+            check_result = check_return
+
+            def check_return(coroutine):
+                return checked_coroutine(coroutine, check_result)
+        return check_return
+
+    def _make_checked_call(self):
+        f = self.function
+        check_arguments = self.check_arguments
+        check_return = self.check_return
+
+        if check_return is None:
+            def _contract(*args, **kwargs):
+                replaced = check_arguments(*args, **kwargs)
+                if replaced is not None:
+                    args, kwargs = replaced
+                return f(*args, **kwargs)
+            return _contract
+
+        def _contract_with_return(*args, **kwargs):
+            replaced = check_arguments(*args, **kwargs)
+            if replaced is not None:
+                args, kwargs = replaced
+            return check_return(f(*args, **kwargs))
+        return _contract_with_return
+
+    def _make_instrumented_call(self, instrumentation):
+        f = self.function
+        check_arguments = self.check_arguments
+        check_return = self.check_return
+        metrics = instrumentation.function(_qualified_name(f))
+
+        def _instrumented_contract(*args, **kwargs):
+            start = _clock()
+            try:
+                replaced = check_arguments(*args, **kwargs)
+            except ContractError:
+                metrics.record(False, _clock() - start)
+                raise
+            if replaced is not None:
+                args, kwargs = replaced
+            elapsed = _clock() - start
+            ret = f(*args, **kwargs)
+            if check_return is not None:
+                start = _clock()
                 try:
-                    param_desc = str(bound_parameters[param])
-                except:
-                    param_desc = type(bound_parameters[param])
-                raise ContractError("Broken contract for parameter %s in function %s (got: %s)" % (param, f.__name__,
-                                                                                                   param_desc))
-        # Check general constraints
-        if constraint is not None and not eval(constraint, bound_parameters):
-            raise ContractError("Broken contract for general constraint '%s' in function %s" % (constraint, f.__name__))
-        ret = f(*args, **kwargs)
-        if returns is not None and not returns.check(ret):
-            raise ContractError('Broken contract for return value of function %s' % f.__name__)
-        return ret
+                    ret = check_return(ret)
+                except ContractError:
+                    metrics.record(False, elapsed + _clock() - start)
+                    raise
+                elapsed += _clock() - start
+            metrics.record(True, elapsed)
+            return ret
+        return _instrumented_contract
+
+    def _make_deferred_call(self, validator):
+        """
+        The call capturing the values of the checked arguments (or their snapshots, taken before the call) and the
+        return value. The return value of coroutine functions is not checked.
+        """
+        f = self.function
+        binder = self.binder
+        submit = validator.submit
+        take_snapshot = validator.take_snapshot if validator.snapshot is not None else None
+        with_return = self.check_return is not None and not _is_coroutine_function(f)
+        contracted = self
+
+        def _deferred_contract(*args, **kwargs):
+            try:
+                bound_values = binder(*args, **kwargs)
+            except TypeError:
+                # Invalid arguments: the call raises the same error
+                return f(*args, **kwargs)
+            if take_snapshot is not None:
+                bound_values = tuple(take_snapshot(value) for value in bound_values)
+            try:
+                ret = f(*args, **kwargs)
+            except:
+                submit(contracted, bound_values, _no_return)
+                raise
+            submit(contracted, bound_values, ret if with_return else _no_return)
+            return ret
+        return _deferred_contract
+
+
+def _describe(value):
+    # noinspection PyBroadException
+    try:
+        return str(value)
+    except:
+        return type(value)
+
+
+def _replace_argument(arguments, name, position, value):
+    args, kwargs = arguments
+    if name in kwargs or position >= len(args):
+        kwargs[name] = value
+    else:
+        args[position] = value
+
+
+def _checked_items(iterator, check_item, description, f):
+    """
+    Iterate over an iterator, checking each item when it is consumed
+    """
+    for index, item in enumerate(iterator):
+        if not check_item(item):
+            raise _item_error(index, item, description, f)
+        yield item
+
+
+def _item_error(index, item, description, f):
+    return ContractError("Broken contract for item %d of %s in function %s (got: %s)" % (
+        index, description, f.__name__, _describe(item)))
+
+
+class _Constraint(object):
+    """
+    A general constraint, parsed once: it is compiled into a function taking only the parameters it references
+    """
+    def __init__(self, text, referenced_names, local_names):
+        self.text = text
+        self.referenced_names = referenced_names
+        self.local_names = local_names  # comprehension variables, lambda arguments...
+
+    def bind_names(self, parameter_names, f):
+        unknown_names = [name for name in sorted(self.referenced_names)
+                         if name not in parameter_names and name not in self.local_names
+                         and not hasattr(builtins, name)]
+        if unknown_names:
+            raise ContractParseError("Use of undefined name(s) %s in constraint '%s' of function %s" % (
+                ', '.join(unknown_names), self.text, f.__name__))
+        return [name for name in parameter_names if name in self.referenced_names]
+
+    def compile(self, argument_names):
+        source = 'lambda %s: (%s)' % (', '.join(argument_names), self.text)
+        return eval(compile(source, '<constraint %s>' % self.text, 'eval'), {})
+
+
+def _parse_constraint(constraint_text):
+    try:
+        tree = ast.parse(constraint_text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ContractParseError("Invalid constraint '%s': %s" % (constraint_text, e.msg))
+    loaded_names = set()
+    local_names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            (loaded_names if isinstance(node.ctx, ast.Load) else local_names).add(node.id)
+        elif isinstance(node, ast.arg):
+            local_names.add(node.arg)
+    return _Constraint(constraint_text.strip(), loaded_names, local_names)
+
+
+def _qualified_name(f):
+    return '%s.%s' % (f.__module__, getattr(f, '__qualname__', f.__name__))
+
+
+def _unchanged(f):
+    return f
+
+
+def _parameter_names(f):
+    """
+    All the names a call to f binds, in signature order (as inspect.getcallargs would return them)
+    """
+    maker = FunctionMaker(f)
+    names = list(maker.args)
+    if maker.varargs:
+        names.append(maker.varargs)
+    names.extend(maker.kwonlyargs)
+    if maker.varkw:
+        names.append(maker.varkw)
+    return names
+
+
+def _make_wrapper(f, call):
+    """
+    Generate a function with the same signature of f, forwarding its arguments to call
+    """
+    wrapper = _create_function(f, 'return _call_(%(shortsignature)s)', {'_call_': call, '_func_': f}, __wrapped__=f)
+    wrapper.__qualname__ = getattr(f, '__qualname__', f.__name__)
+    if _is_coroutine_function(f):
+        # The wrapper is a plain function, so that arguments are checked when it is called (not when it is awaited):
+        # it is just marked as a coroutine function
+        if hasattr(inspect, 'markcoroutinefunction'):
+            inspect.markcoroutinefunction(wrapper)
+        else:
+            import asyncio.coroutines
+            wrapper._is_coroutine = getattr(asyncio.coroutines, '_is_coroutine', None)
+    return wrapper
+
+
+def _create_function(f, body, evaldict, **attrs):
+    """
+    FunctionMaker.create for a function with the same signature of f, keeping its positional-only parameters (lost
+    by getfullargspec): arguments are forwarded positionally, so only the signature needs the '/'
+    """
+    maker = FunctionMaker(f)
+    positional_only = getattr(getattr(f, '__code__', None), 'co_posonlyargcount', 0)
+    if positional_only:
+        arguments = maker.signature.split(', ')
+        arguments.insert(positional_only, '/')
+        maker.signature = ', '.join(arguments)
+    source = 'def %(name)s(%(signature)s):\n' + '\n'.join('    ' + line for line in body.splitlines())
+    return maker.make(source, evaldict, addsource=False, **attrs)
+
+
+def _is_coroutine_function(f):
+    return getattr(inspect, 'iscoroutinefunction', None) is not None and inspect.iscoroutinefunction(f)
+
+
+def _make_binder(f, bound_names):
+    """
+    Generate a function with the same signature (and defaults) of f, returning only the values of bound_names.
+    Python does the argument binding, including defaults, *args and **kwargs, and raises the same TypeError f would.
+    """
+    body = 'return (%s)' % ''.join('%s, ' % name for name in bound_names)
+    return _create_function(f, body, {})
+
+
+class SamplingStats(object):
+    """
+    Counters of a sampled function: how many calls, and how many of them were checked
+    """
+    def __init__(self):
+        self.calls = 0
+        self.checked = 0
+
+    @property
+    def coverage(self):
+        return float(self.checked) / self.calls if self.calls else 0.0
+
+    def __repr__(self):
+        return 'SamplingStats(calls=%d, checked=%d)' % (self.calls, self.checked)
+
+
+class EveryN(object):
+    """
+    Sampling policy: check one call every n (starting from the first one)
+    """
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError('Sampling every %s calls' % n)
+        self.n = int(n)
+
+    def wrap(self, contracted):
+        return _make_sampled_call(contracted, """
+_calls_ = _stats_.calls
+_stats_.calls = _calls_ + 1
+if _calls_ %% _n_:
+    return _func_(%(shortsignature)s)
+_stats_.checked += 1
+return _checked_(%(shortsignature)s)
+""", {'_n_': self.n})
+
 
-    return decorator(_contract)
+class Probability(object):
+    """
+    Sampling policy: check each call with the given probability
+    """
+    def __init__(self, probability):
+        if not 0.0 <= probability <= 1.0:
+            raise ValueError('Sampling probability %s' % probability)
+        self.probability = probability
 
+    def wrap(self, contracted):
+        return _make_sampled_call(contracted, """
+_stats_.calls += 1
+if _random_() >= _probability_:
+    return _func_(%(shortsignature)s)
+_stats_.checked += 1
+return _checked_(%(shortsignature)s)
+""", {'_random_': random, '_probability_': self.probability})
 
-def new_contract(name, assertion):
+
+class TimeBudget(object):
+    """
+    Sampling policy: check calls until the time spent in checks reaches the given milliseconds, in each second
+    """
+    def __init__(self, milliseconds_per_second):
+        self.budget = milliseconds_per_second / 1000.0
+
+    def wrap(self, contracted):
+        f = contracted.function
+        check_arguments = contracted.check_arguments
+        check_return = contracted.check_return
+        window = [0.0, 0.0]  # end of the current second, time spent checking in it
+
+        def timed_call(*args, **kwargs):
+            start = _clock()
+            replaced = check_arguments(*args, **kwargs)
+            if replaced is not None:
+                args, kwargs = replaced
+            called = _clock()
+            ret = f(*args, **kwargs)
+            returned = _clock()
+            if check_return is not None:
+                ret = check_return(ret)
+            window[1] += (called - start) + (_clock() - returned)
+            return ret
+
+        return _make_sampled_call(contracted, """
+_stats_.calls += 1
+_now_ = _clock_()
+if _now_ >= _window_[0]:
+    _window_[0] = _now_ + 1.0
+    _window_[1] = 0.0
+elif _window_[1] >= _budget_:
+    return _func_(%(shortsignature)s)
+_stats_.checked += 1
+return _timed_(%(shortsignature)s)
+""", {'_clock_': _clock, '_window_': window, '_budget_': self.budget, '_timed_': timed_call})
+
+
+def _make_sampled_call(contracted, body, namespace):
+    """
+    Generate the sampling call with the same signature of the function, so that calls not sampled are forwarded to
+    it without packing the arguments
+    """
+    namespace.update(_func_=contracted.function, _stats_=contracted.sampling_stats, _checked_=contracted.checked_call)
+    return _create_function(contracted.function, body.strip(), namespace)
+
+
+def _sampling_policy(policy):
+    """
+    Sampling policies can be given as objects, or as shortcuts: an int n for EveryN(n), a float p for Probability(p)
+    """
+    if policy is None or policy is False:
+        return None
+    if hasattr(policy, 'wrap'):
+        return policy
+    if isinstance(policy, int) and not isinstance(policy, bool):
+        return EveryN(policy)
+    if isinstance(policy, float):
+        return Probability(policy)
+    raise ContractParseError('Invalid sampling policy %r' % (policy,))
+
+
+def sampling_stats(f=None):
+    """
+    The SamplingStats of a decorated function (None if it is not sampled).
+    Without arguments, a dictionary with the stats of all the sampled functions, by qualified name.
+    """
+    if f is not None:
+        return f.__contract__.sampling_stats
+    return dict((_qualified_name(c.function), c.sampling_stats)
+                for c in list(_contracted_functions) if c.sampling_stats is not None)
+
+
+_policy_modes = frozenset(['off', 'full', 'sampled', 'args-only'])
+
+
+def set_policy(rules):
+    """
+    Set the policy of the decorated functions, and apply it to those already decorated. Rules are (pattern, mode)
+    pairs, or their text ('pattern = mode' lines, or separated by ';', with '#' comments). Patterns (fnmatch) are
+    matched against the module and the qualified name of the functions, and the first matching rule gives the mode:
+      - off: contracts are not checked
+      - full: all the calls are checked, also for sampled contracts
+      - sampled, sampled:n, sampled:p: one call every 100 (or every n, or with probability p) is checked
+      - args-only: arguments and _constraint are checked, but not the return value (nor class invariants)
+    The modes apply also to the methods of contract_class, invariants included: in 'sampled' mode, they are checked
+    after the calls sampled by the same policy (but independently from the arguments).
+    Functions not matched by any rule are checked as given in their contracts. Returns the parsed rules.
+    """
+    global _policy
+    _policy = _parse_policy(rules or ())
+    for contracted in list(_contracted_functions):
+        contracted.resolve_policy()
+        if contracted.pending:
+            contracted.install()
+        else:
+            contracted.refresh()
+    for class_contract in list(_class_contracts):
+        class_contract.resolve_policy()
+        class_contract.install()
+    return [(pattern, mode if parameter is None else '%s:%s' % (mode, parameter))
+            for pattern, mode, parameter, _ in _policy]
+
+
+def reload_policy():
+    """
+    Set again the policy from the environment variable SIMPLE_CONTRACTS_POLICY (rules) and the file named by
+    SIMPLE_CONTRACTS_POLICY_FILE: the rules of the variable come first. Returns the parsed rules.
+    """
+    rules = os.environ.get('SIMPLE_CONTRACTS_POLICY', '')
+    policy_file = os.environ.get('SIMPLE_CONTRACTS_POLICY_FILE')
+    if policy_file:
+        with open(policy_file) as f:
+            rules += '\n' + f.read()
+    return set_policy(rules)
+
+
+def _parse_policy(rules):
+    """
+    The rules of a policy, as (pattern, mode, parameter, sampling policy) tuples
+    """
+    if isinstance(rules, str):
+        lines = [line.split('#', 1)[0].strip() for line in re.split(r'[\n;]', rules)]
+        rules = []
+        for line in lines:
+            if not line:
+                continue
+            if '=' not in line:
+                raise ContractParseError('Invalid policy rule "%s": expected "pattern = mode"' % line)
+            rules.append([part.strip() for part in line.rsplit('=', 1)])
+    parsed = []
+    for pattern, mode in rules:
+        mode, _, parameter = mode.partition(':')
+        parameter = parameter.strip() or None
+        if mode not in _policy_modes or (parameter is not None and mode != 'sampled'):
+            raise ContractParseError('Invalid policy mode "%s" for "%s"' % (mode, pattern))
+        policy_sampling = None
+        if mode == 'sampled':
+            try:
+                policy_sampling = _sampling_policy(_family_argument(parameter) if parameter is not None else 100)
+            except ValueError as e:
+                raise ContractParseError('Invalid policy mode "sampled:%s" for "%s": %s' % (parameter, pattern, e))
+        parsed.append((pattern, mode, parameter, policy_sampling))
+    return parsed
+
+
+def _policy_mode(f):
+    """
+    The mode of a function and its sampling policy, from the first rule of the policy matching it: (None, None) if
+    no rule matches
+    """
+    if _policy:
+        module = getattr(f, '__module__', None) or ''
+        qualified_name = _qualified_name(f)
+        for pattern, mode, _, policy_sampling in _policy:
+            if fnmatch.fnmatchcase(qualified_name, pattern) or fnmatch.fnmatchcase(module, pattern):
+                return mode, policy_sampling
+    return None, None
+
+
+_no_return = object()  # marker of the deferred calls without a return value to check
+
+_absent = object()  # marker of the members not in the __dict__ of an instance, for the snapshots of invariants
+
+
+class DeferredValidator(object):
+    """
+    Background checks of the calls of deferred contracts. Calls are captured in a bounded buffer, and checked by a
+    worker thread; violations are passed to handler(function, error), by default logged.
+    When the buffer is full, new calls are dropped and counted, or with block=True the callers wait for a free slot.
+    With a snapshot function (e.g. copy.deepcopy), the checked arguments are checked as they were when the function was
+    called; when the snapshot of an argument fails, the argument itself is checked (and the failure counted).
+    """
+    def __init__(self, capacity=1024, handler=None, block=False, snapshot=None):
+        if capacity < 1:
+            raise ValueError('Deferred buffer capacity %s' % capacity)
+        self.capacity = capacity
+        self.handler = handler or _log_violation
+        self.block = block
+        self.snapshot = snapshot
+        self.captured = 0
+        self.checked = 0
+        self.violations = 0
+        self.dropped = 0
+        self.snapshot_failures = 0
+        self._calls = deque()
+        self._running = 0  # calls taken from the buffer and still being checked
+        self._condition = threading.Condition()
+        self._worker = None
+
+    @property
+    def pending(self):
+        return len(self._calls) + self._running
+
+    def take_snapshot(self, value):
+        # noinspection PyBroadException
+        try:
+            return self.snapshot(value)
+        except:
+            self.snapshot_failures += 1
+            return value
+
+    def submit(self, contracted, bound_values, ret):
+        with self._condition:
+            while len(self._calls) >= self.capacity:
+                if not self.block:
+                    self.dropped += 1
+                    return
+                self._condition.wait()
+            self._calls.append((contracted, bound_values, ret))
+            self.captured += 1
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name='contracts-deferred')
+                self._worker.daemon = True
+                self._worker.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until all the captured calls are checked; returns False if the timeout (in seconds) expired before
+        """
+        deadline = None if timeout is None else _clock() + timeout
+        with self._condition:
+            while self._calls or self._running:
+                remaining = None if deadline is None else deadline - _clock()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._calls:
+                    self._condition.wait()
+                contracted, bound_values, ret = self._calls.popleft()
+                self._running += 1
+                self._condition.notify_all()
+            try:
+                self._check(contracted, bound_values, ret)
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self.checked += 1
+                    self._condition.notify_all()
+
+    def _check(self, contracted, bound_values, ret):
+        # Errors raised by the checks themselves (e.g. by a constraint) are reported as well: they would have been
+        # raised by the call, if checked inline
+        # noinspection PyBroadException
+        try:
+            contracted.check_bound_values(bound_values)
+            if ret is not _no_return:
+                contracted.check_return(ret)
+        except:
+            e = sys.exc_info()[1]
+            self.violations += 1
+            # noinspection PyBroadException
+            try:
+                self.handler(contracted.function, e)
+            except:
+                logging.getLogger(__name__).exception('Error in the handler of deferred contracts')
+
+    def __repr__(self):
+        return 'DeferredValidator(captured=%d, checked=%d, violations=%d, dropped=%d, snapshot_failures=%d)' % (
+            self.captured, self.checked, self.violations, self.dropped, self.snapshot_failures)
+
+
+def _log_violation(f, error):
+    logging.getLogger(__name__).error('Deferred check of %s: %s', _qualified_name(f), error)
+
+
+def _deferred_validator(deferred):
+    """
+    The _deferred option: True for the shared DeferredValidator, or a DeferredValidator
+    """
+    if deferred is None or deferred is False:
+        return None
+    if deferred is True:
+        return get_deferred_validator()
+    if isinstance(deferred, DeferredValidator):
+        return deferred
+    raise ContractParseError('Invalid deferred validator %r' % (deferred,))
+
+
+def get_deferred_validator():
+    """
+    The DeferredValidator shared by the contracts with _deferred=True, created on first use
+    """
+    global _shared_validator
+    if _shared_validator is None:
+        _shared_validator = DeferredValidator()
+    return _shared_validator
+
+
+class Metrics(object):
+    """
+    Counters and timings of a check: passed and failed checks, cumulative time and a histogram of the check times
+    """
+    buckets = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)  # upper bounds in seconds (the last bucket is unbounded)
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.total_time = 0.0
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+    @property
+    def calls(self):
+        return self.passed + self.failed
+
+    def record(self, passed, elapsed):
+        if passed:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.total_time += elapsed
+        self.histogram[bisect_left(self.buckets, elapsed)] += 1
+
+    def as_dict(self):
+        return {'calls': self.calls, 'passed': self.passed, 'failed': self.failed, 'total_time': self.total_time,
+                'buckets': list(self.buckets), 'histogram': list(self.histogram)}
+
+
+class Instrumentation(object):
+    """
+    Metrics of all the contracts checked while instrumentation is on: per decorated function (all its checks, not
+    the function itself), per parameter of each function (including '_constraint' and '_returns') and per named
+    contract (each call of its predicate).
+    """
+    def __init__(self):
+        self.functions = {}  # qualified name -> Metrics
+        self.parameters = {}  # (qualified name, parameter) -> Metrics
+        self.contracts = {}  # contract name -> Metrics
+
+    def function(self, qualified_name):
+        return self.functions.setdefault(qualified_name, Metrics())
+
+    def parameter(self, qualified_name, parameter):
+        return self.parameters.setdefault((qualified_name, parameter), Metrics())
+
+    def contract(self, name):
+        return self.contracts.setdefault(name, Metrics())
+
+    @staticmethod
+    def timed(check, metrics):
+        def timed_check(*args):
+            start = _clock()
+            try:
+                result = check(*args)
+            except:
+                metrics.record(False, _clock() - start)
+                raise
+            metrics.record(result, _clock() - start)
+            return result
+        return timed_check
+
+    def report(self):
+        parameters = {}
+        for (qualified_name, parameter), metrics in self.parameters.items():
+            parameters.setdefault(qualified_name, {})[parameter] = metrics.as_dict()
+        return {'functions': dict((name, m.as_dict()) for name, m in self.functions.items()),
+                'parameters': parameters,
+                'contracts': dict((name, m.as_dict()) for name, m in self.contracts.items())}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), sort_keys=True, **kwargs)
+
+    def to_prometheus(self):
+        lines = []
+        for metric, label_names, table in (
+                ('contracts_function_check', ('function',), self.functions),
+                ('contracts_parameter_check', ('function', 'parameter'), self.parameters),
+                ('contracts_contract_check', ('contract',), self.contracts)):
+            lines.append('# TYPE %s_total counter' % metric)
+            lines.append('# TYPE %s_seconds histogram' % metric)
+            for key, metrics in sorted(table.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = ','.join('%s="%s"' % (name, _prometheus_escape(value))
+                                  for name, value in zip(label_names, key))
+                for result in ('passed', 'failed'):
+                    lines.append('%s_total{%s,result="%s"} %d' % (metric, labels, result, getattr(metrics, result)))
+                cumulative = 0
+                for bound, count in zip(list(metrics.buckets) + ['+Inf'], metrics.histogram):
+                    cumulative += count
+                    lines.append('%s_seconds_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+                lines.append('%s_seconds_sum{%s} %r' % (metric, labels, metrics.total_time))
+                lines.append('%s_seconds_count{%s} %d' % (metric, labels, metrics.calls))
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def set_instrumentation(flag):
+    """
+    Turn instrumentation on (with new, empty metrics) or off, rebuilding the checks of all the decorated functions:
+    when it is off, checks are not instrumented at all.
+    Returns the Instrumentation object collecting the metrics, or None.
+    """
+    global _instrumentation
+    _instrumentation = Instrumentation() if flag else None
+    _rebuild_all()
+    return _instrumentation
+
+
+def get_instrumentation():
+    """
+    The Instrumentation object collecting the metrics, or None if instrumentation is off
+    """
+    return _instrumentation
+
+
+class CheckCache(object):
+    """
+    Bounded LRU cache of the values known to satisfy an assertion, shared by all the contracts.
+    Only values of immutable types (numbers, strings, None, and tuples and frozensets of them) are cached, keyed by
+    their type and value; failed checks are never cached.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (check, value key) -> True, from the least recently used
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def clear(self):
+        self._entries.clear()
+
+    def wrap(self, check):
+        entries = self._entries
+
+        def cached_check(param):
+            value_key = _cache_key(param)
+            if value_key is None:
+                return check(param)
+            key = (check, value_key)
+            try:
+                entries[key] = entries.pop(key)
+                self.hits += 1
+                return True
+            except KeyError:
+                pass
+            self.misses += 1
+            result = check(param)
+            if result:
+                entries[key] = True
+                if len(entries) > self.maxsize:
+                    try:
+                        entries.popitem(last=False)
+                        self.evictions += 1
+                    except KeyError:
+                        pass
+            return result
+        return cached_check
+
+    def __repr__(self):
+        return 'CheckCache(maxsize=%d, size=%d, hits=%d, misses=%d, evictions=%d)' % (
+            self.maxsize, self.size, self.hits, self.misses, self.evictions)
+
+
+_immutable_types = frozenset([bool, int, float, complex, str, bytes, type(None)] +
+                             [getattr(builtins, name) for name in ('long', 'unicode') if hasattr(builtins, name)])
+
+
+def _cache_key(value):
+    """
+    The key of a value in the check cache, or None if it cannot be cached. The types of the items are part of the key:
+    (1, 2), (1.0, 2) and (True, 2) are equal, but may not satisfy the same assertions. The same for the signs of zero:
+    0.0 and -0.0 are equal, but math.copysign tells them apart.
+    """
+    value_type = type(value)
+    if value_type in _immutable_types:
+        if value_type is float:
+            return value_type, value, math.copysign(1.0, value)
+        if value_type is complex:
+            return value_type, value, math.copysign(1.0, value.real), math.copysign(1.0, value.imag)
+        return value_type, value
+    if value_type is tuple or value_type is frozenset:
+        keys = []
+        for item in value:
+            key = _cache_key(item)
+            if key is None:
+                return None
+            keys.append(key)
+        return value_type, value_type(keys)
+    return None
+
+
+def set_check_cache(maxsize):
+    """
+    Turn on the check cache, with a new and empty cache of maxsize entries, or turn it off (maxsize None or 0),
+    rebuilding the checks of all the decorated functions.
+    Returns the CheckCache object, or None.
+    """
+    global _check_cache
+    _check_cache = CheckCache(maxsize) if maxsize else None
+    _rebuild_all()
+    return _check_cache
+
+
+class BranchStats(object):
+    """
+    Counters of a branch of a ',' or '|' assertion in adaptive mode, over the checks measuring all the branches
+    """
+    def __init__(self, assertion):
+        self.assertion = assertion
+        self.calls = 0
+        self.passed = 0
+        self.total_time = 0.0
+
+    @property
+    def pass_rate(self):
+        return float(self.passed) / self.calls if self.calls else 0.0
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def __repr__(self):
+        return 'BranchStats(%r, calls=%d, passed=%d, mean_time=%.3gus)' % (self.assertion, self.calls, self.passed,
+                                                                            self.mean_time * 1e6)
+
+
+def _expected_cost(branch, all_required):
+    """
+    Sort key of a branch: its cost per decisive result (a failure for ',', a success for '|'). This order minimizes
+    the expected cost of the check, for independent branches.
+    """
+    decisive_rate = 1.0 - branch.pass_rate if all_required else branch.pass_rate
+    return branch.mean_time / max(decisive_rate, 1e-3)
+
+
+def set_adaptive(flag):
+    """
+    Turn adaptive ordering of ',' and '|' assertions on or off, rebuilding the checks of all the decorated functions.
+    In adaptive mode, one check every adaptive_period evaluates and times all the branches, and then reorders them.
+    Each branch failing with an exception counts as failed, so that results don't depend on the order.
+    """
+    global _adaptive
+    _adaptive = bool(flag)
+    _rebuild_all()
+
+
+def adaptive_stats(assertion):
+    """
+    The BranchStats of a ',' or '|' assertion (text or parsed), in the current order of evaluation; None when the
+    assertion is not adaptive
+    """
+    if isinstance(assertion, str):
+        assertion = parse_assertion(assertion)
+    if assertion.compiled is None or not isinstance(assertion, ContractAssertion):
+        return None
+    return assertion.branch_stats
+
+
+def _rebuild_all():
+    """
+    Parse and compile again all the assertions, after a change of the global options
+    """
+    _parsed_assertions.clear()
+    _interned_nodes.clear()
+    for contracted in list(_contracted_functions):
+        if not contracted.pending:
+            contracted.refresh()
+    for class_contract in list(_class_contracts):
+        if not class_contract.pending:
+            class_contract.refresh()
+
+
+def get_check_cache():
+    """
+    The CheckCache object, or None if the check cache is off
+    """
+    return _check_cache
+
+
+def new_contract(name, assertion=None, vectorized=None, parallel=None, types=None):
+    """
+    Define (or redefine) a contract, as a boolean function of the parameter.
+    Contracts checking just isinstance(parameter, types) can be defined by types (a type or a tuple) instead: they are
+    checked with a lookup of the type of the parameter, and '|' chains of them with a single lookup.
+    The optional vectorized form checks at once all the items of a buffer (array.array, memoryview, numpy array),
+    when the contract is used in a '[...]' assertion: it returns True or False, or None when it cannot tell (then,
+    items are checked one by one as usual).
+    With parallel='thread' (for predicates releasing the GIL) or 'process' (for picklable, pure predicates), the items
+    of large containers in '[...]' and '{...}' assertions are checked in chunks, in parallel.
+    """
     global _defined_contracts
+    if parallel not in (None, 'thread', 'process'):
+        raise ValueError('Invalid parallel mode %r' % (parallel,))
+    if types is not None:
+        types = tuple(types) if isinstance(types, (tuple, list)) else (types,)
+        if assertion is None:
+            if _type_contracts.get(name) == types:
+                assertion = _defined_contracts[name]
+            else:
+                assertion = _isinstance_predicate(types)
+    elif assertion is None:
+        raise ValueError('Contract %s defined without assertion or types' % name)
+    redefined = name in _defined_contracts and (_defined_contracts[name] is not assertion or
+                                                _vectorized_contracts.get(name) is not vectorized or
+                                                _parallel_contracts.get(name) != parallel or
+                                                _type_contracts.get(name) != types)
     _defined_contracts[name] = assertion
+    if vectorized is not None:
+        _vectorized_contracts[name] = vectorized
+    else:
+        _vectorized_contracts.pop(name, None)
+    if parallel is not None:
+        _parallel_contracts[name] = parallel
+    else:
+        _parallel_contracts.pop(name, None)
+    if types is not None:
+        _type_contracts[name] = types
+    else:
+        _type_contracts.pop(name, None)
+    _fingerprints.pop(name, None)
+    if redefined:
+        _invalidate_contract(name)
+
+
+def new_contract_family(name, factory):
+    """
+    Define (or redefine) a family of contracts, used with arguments in assertions, e.g. 'name(0,100)': factory is
+    called once with the arguments (Python literals, or else strings) and returns the predicate
+    """
+    redefined = name in _contract_families and _contract_families[name] is not factory
+    _contract_families[name] = factory
+    for key in [key for key in _family_checkers if key[0] == name]:
+        del _family_checkers[key]
+    _fingerprints.pop(name, None)
+    if redefined:
+        _invalidate_contract(name)
+
+
+def _isinstance_predicate(types):
+    return lambda x: isinstance(x, types)
+
+
+def _invalidate_contract(name):
+    """
+    Drop the cached assertions and checks using a redefined contract, and rebuild the functions using it
+    """
+    if _check_cache is not None:
+        _check_cache.clear()
+    for assertion_text, parsed_assertion in list(_parsed_assertions.items()):
+        if name in parsed_assertion.contract_names:
+            del _parsed_assertions[assertion_text]
+    for contracted in list(_contracted_functions) + list(_class_contracts):
+        if name in contracted.contract_names:
+            contracted.refresh()
+
+
+def set_enabled(flag):
+    """
+    Turn contracts on or off at runtime, swapping the wrappers of all the decorated functions.
+    Assigning contracts.enabled does the same.
+    """
+    global _enabled
+    _enabled = bool(flag)
+    for contracted in list(_contracted_functions) + list(_class_contracts):
+        contracted.install()
+
+
+# When stripped, contract() returns the original function unchanged: it must be set (or the environment variable
+# SIMPLE_CONTRACTS_STRIP defined) before the decorated modules are imported.
+stripped = os.environ.get('SIMPLE_CONTRACTS_STRIP', '') not in ('', '0')
 
+# When lazy, contracts are parsed on the first call of the decorated function (or by warm_up()), instead of at
+# decoration time. It can be overridden for a single contract with the _lazy option.
+lazy = os.environ.get('SIMPLE_CONTRACTS_LAZY', '') not in ('', '0')
 
-enabled = True
+# Default sampling policy for new contracts (EveryN, Probability, TimeBudget or their shortcuts); it can be overridden
+# for a single contract with the _sample option.
+sampling = None
+
+# Rules of the policy, as parsed by _parse_policy: they are loaded at import time by reload_policy
+_policy = []
+
+# Items of '[...]' and '{...}' assertions on contracts defined with parallel='thread' or 'process' are checked in
+# parallel only in containers with at least parallel_threshold items, in chunks of parallel_chunk_size items.
+parallel_threshold = 10000
+parallel_chunk_size = 1000
+
+_enabled = True
+
+_instrumentation = None
+
+_check_cache = None
+
+# In adaptive mode (see set_adaptive), one check every adaptive_period measures all the branches of ',' and '|'
+adaptive_period = 32
+
+_adaptive = False
+
+_shared_validator = None
+
+_invariant_calls = threading.local()  # calls: ids of the instances with calls checking invariants in progress
+
+# Directory of the on-disk cache of parsed assertions (see set_parse_cache), from SIMPLE_CONTRACTS_CACHE_DIR
+_parse_cache = None
 
 _defined_contracts = {}
 
+_vectorized_contracts = {}  # contract name -> vectorized form
+
+_parallel_contracts = {}  # contract name -> 'thread' or 'process'
+
+_type_contracts = {}  # contract name -> tuple of types, for contracts checking just isinstance
+
+_contract_families = {}  # family name -> factory of the predicates
+
+_family_checkers = {}  # (family name, arguments) -> predicate
+
+_executors = {}  # 'thread' or 'process' -> executor, created on first use
+
+_pool_worker = threading.local()  # active: the thread is checking a chunk in a pool, where items are checked serially
+
+_fingerprints = {}  # contract name -> fingerprint of its definition, for the parse cache
+
+# (node class, arguments) -> node, for hash-consing; nodes stay interned while they are used
+_interned_nodes = weakref.WeakValueDictionary()
+
+_parsed_assertions = {}  # assertion text -> ContractAssertion, shared by all the contracts using the same text
+
+_contracted_functions = weakref.WeakSet()
+
+_class_contracts = weakref.WeakSet()  # _ClassContract objects, refreshed like the contracted functions
+
+
+class _ContractsModule(types.ModuleType):
+    @property
+    def enabled(self):
+        return _enabled
+
+    @enabled.setter
+    def enabled(self, flag):
+        set_enabled(flag)
+
+try:
+    sys.modules[__name__].__class__ = _ContractsModule
+except TypeError:
+    # Module properties are not supported: use set_enabled() to toggle contracts at runtime
+    enabled = True
+
 
 class ContractError(Exception):
     pass
@@ -104,116 +1630,733 @@ class ContractParseError(Exception):
     pass
 
 
-class GenericAssertion(object):
-    def __init__(self, assertion_callable):
-        self.assertion = assertion_callable
-        self.count = 1
+_setattr = object.__setattr__
 
-    def check(self, param):
-        # noinspection PyBroadException
-        try:
-            return self.assertion(param)
-        except:
-            return False
 
+class _Assertion(object):
+    """
+    Base of the parsed assertion nodes. The tree is kept for introspection, but checks run through a single function
+    compiled (once) from the whole tree: no method dispatch, generator expressions or per-level attribute lookups.
+    Nodes are immutable, and hash-consed by _node(): identical subtrees are shared by all the contracts using them.
+    """
+    __slots__ = ('contract_names',  # names of the contracts (defined with new_contract) used by the assertion
+                 'stream_item_assertion',  # assertion on the items, for assertions that can be checked on iterators
+                 '_compiled',
+                 '__weakref__')
 
-class ContractAssertion(object):
-    def __init__(self, parsed_assertions, all_required):
-        self.all_required = all_required
-        self.assertions = parsed_assertions
+    def __init__(self, contract_names=frozenset()):
+        _setattr(self, 'contract_names', contract_names)
+        _setattr(self, 'stream_item_assertion', None)
+        _setattr(self, '_compiled', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Parsed assertions are immutable: cannot set %s.%s' % (type(self).__name__, name))
+
+    @property
+    def compiled(self):
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compile()
+            _setattr(self, '_compiled', compiled)
+        return compiled
 
     def check(self, param):
-        # noinspection PyBroadException
-        try:
-            check_assertions = all if self.all_required else any
-            return check_assertions(a.check(param) for a in self.assertions)
-        except:
-            return False
+        return self.compiled(param)
+
+    def _compile(self):
+        raise NotImplementedError()
+
+
+class GenericAssertion(_Assertion):
+    __slots__ = ('assertion',)
+    count = 1
+
+    def __init__(self, assertion_callable):
+        _Assertion.__init__(self)
+        _setattr(self, 'assertion', assertion_callable)
+
+    def _compile(self):
+        return _compile_predicate(self.assertion)
+
+    def __str__(self):
+        return getattr(self.assertion, '__name__', repr(self.assertion))
+
+
+class ContractAssertion(_Assertion):
+    __slots__ = ('assertions', 'all_required',
+                 'branch_stats')  # BranchStats of the branches in their order of evaluation, in adaptive mode
+
+    def __init__(self, parsed_assertions, all_required):
+        _Assertion.__init__(self, frozenset().union(*[a.contract_names for a in parsed_assertions]))
+        _setattr(self, 'assertions', tuple(parsed_assertions))
+        _setattr(self, 'all_required', all_required)
+        _setattr(self, 'branch_stats', None)
+        if len(parsed_assertions) == 1 and isinstance(parsed_assertions[0], SequenceAssertion):
+            _setattr(self, 'stream_item_assertion',
+                     _node(ContractAssertion, (parsed_assertions[0].internal_assertion,), True))
 
     @property
     def count(self):
         return len(self.assertions)
 
+    def _compile(self):
+        check = self._compile_check()
+        if _check_cache is not None:
+            return _check_cache.wrap(check)
+        return check
 
-class SimpleAssertion(object):
-    def __init__(self, assertion):
-        self.assertion = assertion
+    def _compile_check(self):
+        if len(self.assertions) == 1:
+            only_assertion = self.assertions[0]
+            if isinstance(only_assertion, SimpleAssertion):
+                return _compile_predicate(_leaf_predicate(only_assertion))
+            only_check = only_assertion.compiled
 
-    # noinspection PyBroadException
-    def check(self, param):
+            def check_single(param):
+                # noinspection PyBroadException
+                try:
+                    return True if only_check(param) else False
+                except:
+                    return False
+            return check_single
+
+        if not self.all_required and _instrumentation is None:
+            typed = [a for a in self.assertions if isinstance(a, SimpleAssertion) and a.types is not None]
+            if len(typed) == len(self.assertions):
+                return _compile_types(tuple(t for a in typed for t in a.types))
+            if len(typed) > 1 and not _adaptive:
+                # A single check for all the type contracts, in the place of the first one
+                merged = _compile_types(tuple(t for a in typed for t in a.types))
+                checks = []
+                for a in self.assertions:
+                    if a is typed[0]:
+                        checks.append(merged)
+                    elif a not in typed:
+                        checks.append(a.compiled)
+                return self._compile_checks(tuple(checks))
+        checks = tuple(a.compiled for a in self.assertions)
+        if _adaptive:
+            return self._compile_adaptive(checks)
+        return self._compile_checks(checks)
+
+    def _compile_checks(self, checks):
+        if self.all_required:
+            def check_all(param):
+                # noinspection PyBroadException
+                try:
+                    for check in checks:
+                        if not check(param):
+                            return False
+                    return True
+                except:
+                    return False
+            return check_all
+
+        def check_any(param):
+            # An exception only fails its branch, as in adaptive mode: results don't depend on the order
+            for check in checks:
+                # noinspection PyBroadException
+                try:
+                    if check(param):
+                        return True
+                except:
+                    pass
+            return False
+        return check_any
+
+    def _compile_adaptive(self, checks):
+        all_required = self.all_required
+        branch_stats = [BranchStats(str(a)) for a in self.assertions]
+        _setattr(self, 'branch_stats', branch_stats)
+        # The current order is replaced (never changed in place), so that concurrent checks see either order
+        branches = [tuple(zip(checks, branch_stats))]  # (check, stats) in the current order of evaluation
+        order = [checks]  # checks in the current order of evaluation
+        calls = [0]
+        period = adaptive_period
+
+        def measure(param):
+            result = all_required
+            for check, branch in branches[0]:
+                start = _clock()
+                # noinspection PyBroadException
+                try:
+                    passed = True if check(param) else False
+                except:
+                    passed = False
+                branch.total_time += _clock() - start
+                branch.calls += 1
+                if passed:
+                    branch.passed += 1
+                if passed != all_required:
+                    result = passed
+            ordered = tuple(sorted(branches[0], key=lambda b: _expected_cost(b[1], all_required)))
+            branches[0] = ordered
+            order[0] = tuple(check for check, _ in ordered)
+            _setattr(self, 'branch_stats', [branch for _, branch in ordered])
+            return result
+
+        if all_required:
+            def check_all_adaptive(param):
+                count = calls[0]
+                calls[0] = count + 1
+                if count % period == 0:
+                    return measure(param)
+                for check in order[0]:
+                    # noinspection PyBroadException
+                    try:
+                        if not check(param):
+                            return False
+                    except:
+                        return False
+                return True
+            return check_all_adaptive
+
+        def check_any_adaptive(param):
+            count = calls[0]
+            calls[0] = count + 1
+            if count % period == 0:
+                return measure(param)
+            for check in order[0]:
+                # noinspection PyBroadException
+                try:
+                    if check(param):
+                        return True
+                except:
+                    pass
+            return False
+        return check_any_adaptive
+
+    def __str__(self):
+        return (',' if self.all_required else '|').join(str(a) for a in self.assertions)
+
+
+class SimpleAssertion(_Assertion):
+    __slots__ = ('assertion', 'name', 'vectorized', 'parallel', 'types',
+                 'arguments')  # arguments of a contract family, or None
+
+    def __init__(self, assertion, name=None, vectorized=None, parallel=None, types=None, arguments=None):
+        _Assertion.__init__(self, frozenset([name]) if name is not None else frozenset())
+        _setattr(self, 'assertion', assertion)
+        _setattr(self, 'name', name)
+        _setattr(self, 'vectorized', vectorized)
+        _setattr(self, 'parallel', parallel)
+        _setattr(self, 'types', types)
+        _setattr(self, 'arguments', arguments)
+
+    def _compile(self):
+        assertion = _leaf_predicate(self)
+
+        def check_simple(param):
+            # noinspection PyBroadException
+            try:
+                return assertion(param)
+            except:
+                return False
+        return check_simple
+
+    def __str__(self):
+        if self.name is None:
+            return getattr(self.assertion, '__name__', repr(self.assertion))
+        if self.arguments is not None:
+            return '%s(%s)' % (self.name, ','.join(a if isinstance(a, str) else repr(a) for a in self.arguments))
+        return self.name
+
+
+def _leaf_predicate(simple_assertion):
+    """
+    The predicate to call for a simple assertion: timed, if instrumentation was on when the assertion was compiled,
+    or else a lookup of the type of the parameter for type contracts
+    """
+    if _instrumentation is not None and simple_assertion.name is not None:
+        return _instrumentation.timed(simple_assertion.assertion, _instrumentation.contract(str(simple_assertion)))
+    if simple_assertion.types is not None:
+        return _compile_types(simple_assertion.types)
+    return simple_assertion.assertion
+
+
+_type_cache_size = 256  # maximum number of concrete types cached by each type check
+
+
+def _compile_types(types):
+    """
+    Check isinstance(param, types), caching the result for each concrete type of the parameter. Types registered to
+    an ABC after being cached are not seen: register them before checking contracts.
+    """
+    results = {}  # concrete type -> result
+
+    def check_types(param):
+        param_type = type(param)
         try:
-            return self.assertion(param)
+            return results[param_type]
+        except KeyError:
+            result = isinstance(param, types)
+            if param_type is param.__class__ and len(results) < _type_cache_size:
+                results[param_type] = result
+            return result
+    return check_types
+
+
+def _compile_predicate(assertion):
+    """
+    A whole (top-level) check made of a single predicate: its result is normalized to a bool
+    """
+    def check_predicate(param):
+        # noinspection PyBroadException
+        try:
+            return True if assertion(param) else False
         except:
             return False
+    return check_predicate
 
 
-class SequenceAssertion(object):
-    def __init__(self, inner_assertion):
-        self.internal_assertion = inner_assertion
+def _compile_all_items(inner_assertion):
+    """
+    Check all the items of an iterable; when the inner assertion is a simple one, its predicate is called directly
+    """
+    if not isinstance(inner_assertion, SimpleAssertion):
+        inner_check = inner_assertion.compiled
 
-    def check(self, param):
-        try:
-            if isinstance(param, collections.Mapping):
-                param = list(param.keys())
-            # noinspection PyUnresolvedReferences
-            is_sequence = isinstance(param, self.sequence_type) and not isinstance(param, str)
-            if not is_sequence:
+        def check_items(items):
+            for item in items:
+                if not inner_check(item):
+                    return False
+            return True
+        return check_items
+
+    predicate = _leaf_predicate(inner_assertion)
+
+    def check_simple_items(items):
+        for item in items:
+            # noinspection PyBroadException
+            try:
+                result = predicate(item)
+            except:
                 return False
-            return all(self.internal_assertion.check(p) for p in param)
+            if not result:
+                return False
+        return True
+    if inner_assertion.parallel is not None and ThreadPoolExecutor is not None:
+        return _compile_parallel(inner_assertion, check_simple_items)
+    return check_simple_items
+
+
+def _compile_parallel(simple_assertion, check_items):
+    """
+    Check the items of large containers in chunks, in a thread or process pool, stopping at the first failing chunk.
+    Items of sampled assertions (without a length) are checked serially, as well as all the items when the predicate
+    can't be sent to the process pool.
+    """
+    kind = simple_assertion.parallel
+    # The timed predicate of instrumentation can't be pickled, and its metrics would stay in the other processes
+    predicate = simple_assertion.assertion if kind == 'process' else _leaf_predicate(simple_assertion)
+    failed_pool = []  # not empty, after the pool failed once (e.g. the predicate can't be pickled)
+
+    def check_parallel(items):
+        try:
+            size = len(items)
         except TypeError:
-            return False
+            return check_items(items)
+        if size < parallel_threshold or failed_pool or getattr(_pool_worker, 'active', False):
+            # Inside a worker of the pool, waiting for other chunks in the same pool could deadlock
+            return check_items(items)
+        if not isinstance(items, Sequence):
+            items = list(items)
+        stop = threading.Event() if kind == 'thread' else None
+        futures = [_executor(kind).submit(_check_chunk, predicate, items[start:start + parallel_chunk_size], stop)
+                   for start in range(0, size, parallel_chunk_size)]
+        try:
+            for future in as_completed(futures):
+                if not future.result():
+                    return False
+            return True
+        except Exception:
+            failed_pool.append(sys.exc_info()[1])
+            return check_items(items)
+        finally:
+            if stop is not None:
+                stop.set()
+            for future in futures:
+                future.cancel()
+    return check_parallel
+
+
+def _check_chunk(predicate, items, stop=None):
+    _pool_worker.active = True
+    try:
+        for item in items:
+            if stop is not None and stop.is_set():
+                return True
+            # noinspection PyBroadException
+            try:
+                result = predicate(item)
+            except:
+                return False
+            if not result:
+                return False
+        return True
+    finally:
+        _pool_worker.active = False
+
+
+def _executor(kind):
+    executor = _executors.get(kind)
+    if executor is None:
+        if kind == 'thread':
+            executor = ThreadPoolExecutor(getattr(os, 'cpu_count', lambda: None)() or 4)
+        else:
+            executor = ProcessPoolExecutor()
+        executor = _executors.setdefault(kind, executor)
+    return executor
+
+
+def _compile_vectorized(vectorized, check_items):
+    """
+    Check all the items of a buffer at once, falling back to checking them one by one
+    """
+    def check_buffer(items):
+        # noinspection PyBroadException
+        try:
+            result = vectorized(items)
+        except:
+            result = None
+        return check_items(items) if result is None else result
+    return check_buffer
+
+
+def _is_buffer(param):
+    if isinstance(param, (array, memoryview)):
+        return True
+    # numpy is an optional dependency: if it was not imported, there cannot be numpy arrays
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(param, numpy.ndarray)
+
+
+_builtin_sequences = frozenset([list, tuple, dict, str, set, frozenset])
+
+
+class SequenceAssertion(_Assertion):
+    __slots__ = ('internal_assertion', 'sample_size')
+
+    def __init__(self, inner_assertion, sample_size=None):
+        _Assertion.__init__(self, inner_assertion.contract_names)
+        _setattr(self, 'internal_assertion', inner_assertion)
+        _setattr(self, 'sample_size', sample_size)
+
+    def _compile(self):
+        check_items = _compile_all_items(self.internal_assertion)
+        # noinspection PyUnresolvedReferences
+        sequence_type = self.sequence_type
+        vectorized = getattr(self.internal_assertion, 'vectorized', None)
+        check_buffer = _compile_vectorized(vectorized, check_items) if vectorized is not None else None
+        sample_size = self.sample_size
+
+        def check_sequence(param):
+            try:
+                if check_buffer is not None and type(param) not in _builtin_sequences and _is_buffer(param):
+                    return check_buffer(param)
+                if isinstance(param, Mapping):
+                    items = param.keys()
+                elif not isinstance(param, sequence_type) or isinstance(param, str):
+                    return False
+                else:
+                    items = param
+                if sample_size is not None:
+                    items = _sample(items, sample_size)
+                return check_items(items)
+            except TypeError:
+                return False
+        return check_sequence
+
+    def __str__(self):
+        return '[%s]%s' % (self.internal_assertion, '~%d' % self.sample_size if self.sample_size else '')
 
 try:
     # noinspection PyUnresolvedReferences
     from System.Collections import IEnumerable
     SequenceAssertion.sequence_type = IEnumerable
 except ImportError:
-    SequenceAssertion.sequence_type = collections.Sequence
+    SequenceAssertion.sequence_type = Sequence
 
 
-class MappingAssertion(object):
-    def __init__(self, inner_assertion):
-        self.internal_assertion = inner_assertion
+class MappingAssertion(_Assertion):
+    __slots__ = ('internal_assertion', 'sample_size')
 
-    def check(self, param):
-        try:
-            if not isinstance(param, collections.Mapping):
+    def __init__(self, inner_assertion, sample_size=None):
+        _Assertion.__init__(self, inner_assertion.contract_names)
+        _setattr(self, 'internal_assertion', inner_assertion)
+        _setattr(self, 'sample_size', sample_size)
+
+    def _compile(self):
+        check_items = _compile_all_items(self.internal_assertion)
+        sample_size = self.sample_size
+
+        def check_mapping(param):
+            try:
+                if not isinstance(param, Mapping):
+                    return False
+                if sample_size is not None:
+                    return check_items(_sample(param.values(), sample_size))
+                return check_items(param.values())
+            except TypeError:
                 return False
-            return all(self.internal_assertion.check(p) for p in param.values())
-        except TypeError:
-            return False
+        return check_mapping
+
+    def __str__(self):
+        return '{%s}%s' % (self.internal_assertion, '~%d' % self.sample_size if self.sample_size else '')
+
 
+def _sample(items, sample_size):
+    """
+    At most sample_size items (at least 2): the first, the last, and the others strided from a random offset, so that
+    repeated checks cover different items. Sequences are indexed; mapping views are iterated, but not copied.
+    """
+    size = len(items)
+    if size <= sample_size:
+        return items
+    inner_size = sample_size - 2
+    step = float(size - 2) / inner_size if inner_size else 1.0
+    offset = random() * step
+    if isinstance(items, Sequence):
+        indices = [0] + [1 + int(offset + i * step) for i in range(inner_size)] + [size - 1]
+        return map(items.__getitem__, indices)
+    iterator = iter(items)
+    first = [next(iterator)]
+    strided = islice(islice(iterator, int(offset), size - 2, max(1, int(step))), inner_size)
+    try:
+        last = [next(reversed(items))]
+    except TypeError:
+        last = []
+    return chain(first, strided, last)
+
+
+class MemberAssertion(_Assertion):
+    __slots__ = ('member_name', 'internal_assertion')
 
-class MemberAssertion(object):
     def __init__(self, member_name, inner_assertion):
-        self.member_name = member_name
-        self.internal_assertion = inner_assertion
+        _Assertion.__init__(self, inner_assertion.contract_names)
+        _setattr(self, 'member_name', member_name)
+        _setattr(self, 'internal_assertion', inner_assertion)
 
-    def check(self, param):
-        member = getattr(param, self.member_name)
-        return self.internal_assertion.check(member)
-
-
-def _parse_single_assertion(assertion_text):
-    # Sequence
-    match = re.match(r'\[(.*)\]', assertion_text)
-    if match:
-        inner_assertion = _parse_single_assertion(match.groups()[0])
-        return SequenceAssertion(inner_assertion)
-    # Mapping
-    match = re.match(r'\{(.*)\}', assertion_text)
-    if match:
-        inner_assertion = _parse_single_assertion(match.groups()[0])
-        return MappingAssertion(inner_assertion)
-    # Member
-    match = re.match(r'(.*):(.*)', assertion_text)
-    if match:
-        inner_assertion = _parse_single_assertion(match.groups()[1])
-        return MemberAssertion(match.groups()[0], inner_assertion)
-    # Simple
-    if assertion_text not in _defined_contracts.keys():
-        raise ContractParseError("Use of undefined contract \"%s\"" % assertion_text)
-    return SimpleAssertion(_defined_contracts[assertion_text])
+    def _compile(self):
+        member_name = self.member_name
+        inner_check = self.internal_assertion.compiled
+
+        def check_member(param):
+            return inner_check(getattr(param, member_name))
+        return check_member
+
+    def __str__(self):
+        return '%s:%s' % (self.member_name, self.internal_assertion)
+
+
+def _node(node_class, *args):
+    """
+    The node built with these arguments, shared with any other identical one (hash-consing): as children are nodes
+    interned in turn, identical subtrees are the same object, and are compiled only once
+    """
+    key = (node_class,) + args
+    node = _interned_nodes.get(key)
+    if node is None:
+        node = _interned_nodes.setdefault(key, node_class(*args))
+    return node
+
+
+def _family_argument(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def _family_node(name, arguments):
+    """
+    The node of a contract family with these arguments: the checker built by the family is shared by all the
+    assertions using the same arguments (and of the same types)
+    """
+    key = (name, tuple((type(argument), argument) for argument in arguments))
+    checker = _family_checkers.get(key)
+    if checker is None:
+        checker = _family_checkers.setdefault(key, _contract_families[name](*arguments))
+    return _node(SimpleAssertion, checker, name, None, None, None, arguments)
+
+
+def _simple_node(name):
+    return _node(SimpleAssertion, _defined_contracts[name], name, _vectorized_contracts.get(name),
+                 _parallel_contracts.get(name), _type_contracts.get(name))
+
+
+def memory_report():
+    """
+    How many assertion nodes are used by the decorated functions, and how much they are shared: 'references' counts
+    the nodes in all the trees as if they were not shared, 'nodes' the distinct ones (also by type), 'shared' those
+    used more than once, and 'bytes' the size of the distinct nodes
+    """
+    references = {}  # id -> [node, count]
+    for contracted in list(_contracted_functions):
+        for assertion in contracted.assertion_list.values():
+            if isinstance(assertion, str) and assertion in _parsed_assertions:
+                _count_references(_parsed_assertions[assertion], references)
+    by_type = {}
+    for node, _ in references.values():
+        by_type[type(node).__name__] = by_type.get(type(node).__name__, 0) + 1
+    return {'functions': len(_contracted_functions),
+            'references': sum(count for _, count in references.values()),
+            'nodes': len(references),
+            'shared': sum(1 for _, count in references.values() if count > 1),
+            'interned': len(_interned_nodes),
+            'bytes': sum(sys.getsizeof(node) for node, _ in references.values()),
+            'by_type': by_type}
+
+
+def _count_references(node, references):
+    entry = references.get(id(node))
+    if entry is None:
+        references[id(node)] = [node, 1]
+    else:
+        entry[1] += 1
+    if isinstance(node, ContractAssertion):
+        for child in node.assertions:
+            _count_references(child, references)
+    elif isinstance(node, (SequenceAssertion, MappingAssertion, MemberAssertion)):
+        _count_references(node.internal_assertion, references)
+
+
+_token_pattern = re.compile(r'\s*(?:([\[\]{}(),|:~])|([^\[\]{}(),|:~]+))')
+
+
+def _tokenize(text):
+    """
+    The tokens of an assertion, as (kind, value, position): kind is the operator itself, or 'name' for contract and
+    member names (stripped), and None for the end of the text
+    """
+    tokens = []
+    position = 0
+    while True:
+        match = _token_pattern.match(text, position)
+        if match is None:
+            break
+        if match.group(1) is not None:
+            tokens.append((match.group(1), match.group(1), match.start(1)))
+        else:
+            name = match.group(2).rstrip()
+            if name:
+                tokens.append(('name', name, match.start(2)))
+        position = match.end()
+    tokens.append((None, None, len(text)))
+    return tokens
+
+
+class _AssertionParser(object):
+    """
+    Recursive-descent parser of the assertion language, in a single pass over the tokens:
+
+        alternatives := conjunction ('|' conjunction)*
+        conjunction  := term (',' term)*
+        term         := '[' alternatives ']' ['~' size] | '{' alternatives '}' ['~' size] | '(' alternatives ')'
+                        | name ':' term | name '(' [argument (',' argument)*] ')' | name
+
+    so ',' binds tighter than '|', and 'member:' applies to the following term only. Arguments of contract families
+    are Python literals, or else strings.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.index = 0
+
+    def parse(self):
+        try:
+            node = self._alternatives()
+        except RuntimeError:
+            # RecursionError, on Python 3
+            raise ContractParseError('Assertion nested too deeply: "%s..."' % self.text[:50])
+        if self._kind() is not None:
+            raise self._error('Unexpected token')
+        if isinstance(node, ContractAssertion):
+            return node
+        return _node(ContractAssertion, (node,), True)
+
+    def _kind(self):
+        return self.tokens[self.index][0]
+
+    def _next(self, expected):
+        kind, value, position = self.tokens[self.index]
+        if kind != expected:
+            raise self._error("Expected %s" % ("a name" if expected == 'name' else "'%s'" % expected))
+        self.index += 1
+        return value, position
+
+    def _error(self, message):
+        kind, value, position = self.tokens[self.index]
+        found = 'end of assertion' if kind is None else "'%s'" % value
+        return ContractParseError('%s at position %d (found %s) in "%s"' % (message, position, found, self.text))
+
+    def _alternatives(self):
+        conjunctions = [self._conjunction()]
+        while self._kind() == '|':
+            self.index += 1
+            conjunctions.append(self._conjunction())
+        return conjunctions[0] if len(conjunctions) == 1 else _node(ContractAssertion, tuple(conjunctions), False)
+
+    def _conjunction(self):
+        terms = [self._term()]
+        while self._kind() == ',':
+            self.index += 1
+            terms.append(self._term())
+        return terms[0] if len(terms) == 1 else _node(ContractAssertion, tuple(terms), True)
+
+    def _term(self):
+        kind = self._kind()
+        if kind == '[' or kind == '{':
+            self.index += 1
+            inner = self._alternatives()
+            self._next(']' if kind == '[' else '}')
+            sample_size = self._sample_size()
+            return _node(SequenceAssertion if kind == '[' else MappingAssertion, inner, sample_size)
+        if kind == '(':
+            self.index += 1
+            inner = self._alternatives()
+            self._next(')')
+            return inner
+        name, position = self._next('name')
+        if self._kind() == ':':
+            self.index += 1
+            return _node(MemberAssertion, name, self._term())
+        if self._kind() == '(':
+            return self._family(name, position)
+        if name not in _defined_contracts:
+            raise ContractParseError('Use of undefined contract "%s" at position %d in "%s"' % (name, position,
+                                                                                                self.text))
+        return _simple_node(name)
+
+    def _family(self, name, position):
+        self.index += 1
+        arguments = []
+        if self._kind() != ')':
+            arguments.append(_family_argument(self._next('name')[0]))
+            while self._kind() == ',':
+                self.index += 1
+                arguments.append(_family_argument(self._next('name')[0]))
+        self._next(')')
+        if name not in _contract_families:
+            raise ContractParseError('Use of undefined contract family "%s" at position %d in "%s"' % (
+                name, position, self.text))
+        try:
+            return _family_node(name, tuple(arguments))
+        except ContractParseError:
+            raise
+        except Exception:
+            raise ContractParseError('Invalid arguments of contract family "%s" at position %d in "%s": %s' % (
+                name, position, self.text, sys.exc_info()[1]))
+
+    def _sample_size(self):
+        if self._kind() != '~':
+            return None
+        self.index += 1
+        kind, value, position = self.tokens[self.index]
+        if kind != 'name' or not value.isdigit() or int(value) < 2:
+            raise self._error('Expected a sample size of at least 2')
+        self.index += 1
+        return int(value)
 
 
 def parse_assertion(assertion):
@@ -221,10 +2364,304 @@ def parse_assertion(assertion):
         return GenericAssertion(assertion)
 
     assert (isinstance(assertion, str))
-    # Multiple assertions
-    if ',' in assertion and '|' in assertion:
-        raise ContractParseError("Cannot use operators ',' and '|' in the same contract assertion")
-    separator_char = '|' if '|' in assertion else ','
-    assertions = [assertion.strip() for assertion in assertion.split(separator_char)]
-    parsed_assertions = [_parse_single_assertion(assertion_text) for assertion_text in assertions]
-    return ContractAssertion(parsed_assertions, separator_char == ',')
+    parsed_assertion = _parsed_assertions.get(assertion)
+    if parsed_assertion is None:
+        if _parse_cache is not None:
+            parsed_assertion = _parse_cache.load(assertion)
+        if parsed_assertion is None:
+            parsed_assertion = _AssertionParser(assertion).parse()
+            if _parse_cache is not None:
+                _parse_cache.store(assertion, parsed_assertion)
+        _parsed_assertions[assertion] = parsed_assertion
+    return parsed_assertion
+
+
+class BatchReport(object):
+    """
+    The result of check_many: how many records were checked and failed, and the failures as (index, path) pairs, path
+    telling where the record fails: '' for the record itself, '.member', '[i]' (item i), '[key k]' (a key) and
+    '{k}' (the value of key k) for its parts, e.g. '.items[2].name'. Only the first max_failures are kept.
+    """
+    def __init__(self, max_failures=None):
+        self.max_failures = max_failures
+        self.checked = 0
+        self.failed = 0
+        self.failures = []
+
+    @property
+    def passed(self):
+        return self.checked - self.failed
+
+    @property
+    def failing_indices(self):
+        return [index for index, _ in self.failures]
+
+    @property
+    def truncated(self):
+        return self.failed > len(self.failures)
+
+    def __bool__(self):
+        return self.failed == 0
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return 'BatchReport(checked=%d, failed=%d, failures=%r%s)' % (
+            self.checked, self.failed, self.failures[:10], '...' if len(self.failures) > 10 else '')
+
+
+def check_many(assertion, records, max_failures=1000):
+    """
+    Check all the records (any iterable, consumed once) against the assertion; returns a BatchReport.
+    Records are checked with the compiled assertion; only the failing ones are checked again, to find the path of the
+    failure. Memory is bounded by max_failures (None for no limit), so records can be streamed.
+    """
+    report = BatchReport(max_failures)
+    parsed = parse_assertion(assertion)
+    check = parsed.compiled
+    index = -1
+    for index, record in enumerate(records):
+        if not check(record):
+            report.failed += 1
+            if max_failures is None or len(report.failures) < max_failures:
+                report.failures.append((index, _failure_path(parsed, record)))
+    report.checked = index + 1
+    return report
+
+
+def iter_failures(assertion, records):
+    """
+    The failures of the records (any iterable, consumed lazily) against the assertion, as (index, path) pairs
+    """
+    parsed = parse_assertion(assertion)
+    check = parsed.compiled
+    for index, record in enumerate(records):
+        if not check(record):
+            yield index, _failure_path(parsed, record)
+
+
+def check_columns(assertions, columns, max_failures=1000):
+    """
+    Check a columnar batch: assertions and columns are mappings from column names to assertions and to sequences (or
+    buffers) of values. Returns a BatchReport per column. Columns passing as a whole, e.g. with a vectorized contract
+    on a buffer, are checked at once.
+    """
+    reports = {}
+    for name, assertion in assertions.items():
+        column = columns[name]
+        if isinstance(assertion, str) and parse_assertion('[(%s)]' % assertion).check(column):
+            report = reports[name] = BatchReport(max_failures)
+            report.checked = len(column)
+        else:
+            reports[name] = check_many(assertion, column, max_failures)
+    return reports
+
+
+def _passes(node, value):
+    # noinspection PyBroadException
+    try:
+        return True if node.compiled(value) else False
+    except:
+        return False
+
+
+def _failure_path(node, value):
+    """
+    Where value fails the assertion node: the path of its first failing part, or '' when it fails as a whole
+    """
+    if isinstance(node, ContractAssertion):
+        if node.all_required or len(node.assertions) == 1:
+            for assertion in node.assertions:
+                if not _passes(assertion, value):
+                    return _failure_path(assertion, value)
+        return ''
+    if isinstance(node, MemberAssertion):
+        try:
+            member = getattr(value, node.member_name)
+        except AttributeError:
+            return '.' + node.member_name
+        return '.%s%s' % (node.member_name, _failure_path(node.internal_assertion, member))
+    inner = getattr(node, 'internal_assertion', None)
+    if isinstance(node, SequenceAssertion) and isinstance(value, Mapping):
+        for key in value.keys():
+            if not _passes(inner, key):
+                return '[key %r]%s' % (key, _failure_path(inner, key))
+    elif isinstance(node, SequenceAssertion) and isinstance(value, node.sequence_type) and not isinstance(value, str):
+        for index, item in enumerate(value):
+            if not _passes(inner, item):
+                return '[%d]%s' % (index, _failure_path(inner, item))
+    elif isinstance(node, MappingAssertion) and isinstance(value, Mapping):
+        for key, item in value.items():
+            if not _passes(inner, item):
+                return '{%r}%s' % (key, _failure_path(inner, item))
+    return ''
+
+
+class ParseCache(object):
+    """
+    On-disk cache of parsed assertions, shared by the processes using the same directory, like .pyc files: a single
+    file per Python version, read on first use and written atomically (merged with the entries written by other
+    processes in the meantime) by save(), and at exit.
+    Each entry holds the tree of an assertion and the fingerprints of the contracts it uses: it is parsed again if any
+    of them was redefined (with different code, defaults or closure values).
+    """
+    def __init__(self, directory):
+        cache_tag = getattr(getattr(sys, 'implementation', None), 'cache_tag', None) or 'py%d%d' % sys.version_info[:2]
+        self.path = os.path.join(directory, 'contracts.%s.cache' % cache_tag)
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._entries = None  # assertion text -> (tree, ((contract name, fingerprint), ...))
+        self._added = {}  # entries not saved yet
+        self._registered = False
+
+    def load(self, text):
+        if self._entries is None:
+            self._entries = self._read()
+        entry = self._entries.get(text)
+        if entry is None:
+            self.misses += 1
+            return None
+        tree, fingerprints = entry
+        for name, fingerprint in fingerprints:
+            if (name not in _defined_contracts and name not in _contract_families) or \
+                    _fingerprint(name) != fingerprint:
+                self.stale += 1
+                return None
+        self.hits += 1
+        return _from_tree(tree)
+
+    def store(self, text, parsed):
+        entry = (_to_tree(parsed), tuple((name, _fingerprint(name)) for name in sorted(parsed.contract_names)))
+        if self._entries is None:
+            self._entries = self._read()
+        self._entries[text] = self._added[text] = entry
+        if not self._registered:
+            self._registered = True
+            atexit.register(self.save)
+
+    def save(self):
+        """
+        Write the new entries to the cache file, if any; errors (e.g. a read-only directory) are ignored
+        """
+        if not self._added:
+            return
+        directory = os.path.dirname(self.path)
+        # noinspection PyBroadException
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            entries = self._read()
+            entries.update(self._added)
+            handle, temporary_path = tempfile.mkstemp(dir=directory, prefix='.contracts', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as cache_file:
+                    cache_file.write(marshal.dumps(entries))
+                _replace(temporary_path, self.path)
+            except:
+                os.remove(temporary_path)
+                raise
+            self._added = {}
+        except:
+            logging.getLogger(__name__).warning('Cannot write the parse cache %s', self.path, exc_info=True)
+
+    def _read(self):
+        # noinspection PyBroadException
+        try:
+            with open(self.path, 'rb') as cache_file:
+                entries = marshal.loads(cache_file.read())
+            return entries if isinstance(entries, dict) else {}
+        except:
+            # Missing, or corrupted
+            return {}
+
+    def __repr__(self):
+        return 'ParseCache(%r, hits=%d, misses=%d, stale=%d)' % (self.path, self.hits, self.misses, self.stale)
+
+
+_replace = getattr(os, 'replace', os.rename)  # atomic on POSIX; os.replace is atomic on Windows too (Python 3.3+)
+
+
+def _to_tree(node):
+    """
+    The parsed assertion as nested tuples, that can be marshalled: predicates are referenced by contract name
+    """
+    if isinstance(node, ContractAssertion):
+        return 'all' if node.all_required else 'any', tuple(_to_tree(a) for a in node.assertions)
+    if isinstance(node, SequenceAssertion):
+        return 'sequence', _to_tree(node.internal_assertion), node.sample_size or 0
+    if isinstance(node, MappingAssertion):
+        return 'mapping', _to_tree(node.internal_assertion), node.sample_size or 0
+    if isinstance(node, MemberAssertion):
+        return 'member', node.member_name, _to_tree(node.internal_assertion)
+    if node.arguments is not None:
+        return 'family', node.name, node.arguments
+    return 'contract', node.name
+
+
+def _from_tree(tree):
+    kind = tree[0]
+    if kind == 'all' or kind == 'any':
+        return _node(ContractAssertion, tuple(_from_tree(t) for t in tree[1]), kind == 'all')
+    if kind == 'sequence':
+        return _node(SequenceAssertion, _from_tree(tree[1]), tree[2] or None)
+    if kind == 'mapping':
+        return _node(MappingAssertion, _from_tree(tree[1]), tree[2] or None)
+    if kind == 'member':
+        return _node(MemberAssertion, tree[1], _from_tree(tree[2]))
+    if kind == 'family':
+        return _family_node(tree[1], tree[2])
+    return _simple_node(tree[1])
+
+
+def _fingerprint(name):
+    fingerprint = _fingerprints.get(name)
+    if fingerprint is None:
+        digest = hashlib.sha1(name.encode('utf-8'))
+        for definition in (_defined_contracts.get(name), _vectorized_contracts.get(name), _parallel_contracts.get(name),
+                           _type_contracts.get(name), _contract_families.get(name)):
+            _hash_definition(digest, definition, 3)
+        fingerprint = _fingerprints[name] = digest.hexdigest()
+    return fingerprint
+
+
+def _hash_definition(digest, definition, depth):
+    """
+    Hash the code of a function, with its defaults and closure values (nested functions up to depth); other objects
+    by name, or by repr
+    """
+    code = getattr(definition, '__code__', None)
+    if code is None or depth == 0:
+        name = getattr(definition, '__qualname__', None) or getattr(definition, '__name__', None)
+        text = '%s.%s' % (getattr(definition, '__module__', ''), name) if name else repr(definition)
+        digest.update(text.encode('utf-8'))
+        return
+    digest.update(marshal.dumps(code))
+    for value in definition.__defaults__ or ():
+        _hash_definition(digest, value, depth - 1)
+    for cell in definition.__closure__ or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            # Empty cell
+            continue
+        _hash_definition(digest, value, depth - 1)
+
+
+def set_parse_cache(directory):
+    """
+    Use the on-disk cache of parsed assertions in directory (created if needed), or stop using it (None).
+    Returns the ParseCache object, or None.
+    """
+    global _parse_cache
+    if _parse_cache is not None:
+        _parse_cache.save()
+    _parse_cache = ParseCache(directory) if directory else None
+    return _parse_cache
+
+
+if os.environ.get('SIMPLE_CONTRACTS_CACHE_DIR'):
+    set_parse_cache(os.environ['SIMPLE_CONTRACTS_CACHE_DIR'])
+
+if os.environ.get('SIMPLE_CONTRACTS_POLICY') or os.environ.get('SIMPLE_CONTRACTS_POLICY_FILE'):
+    reload_policy()
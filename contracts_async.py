@@ -0,0 +1,52 @@
+"""
+Support of contracts for coroutine functions and asynchronous iterators.
+It is a separate module because it needs the async syntax: contracts works without it, on older interpreters.
+"""
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # Python 3.6: invariants are checked also after nested calls on the same instance
+    ContextVar = None
+
+# Ids of the instances with coroutine methods checking invariants in progress, in the current task
+_invariant_calls = ContextVar('invariant_calls', default=frozenset()) if ContextVar is not None else None
+
+
+async def checked_coroutine(coroutine, check_return):
+    """
+    Await a coroutine, checking its result
+    """
+    return check_return(await coroutine)
+
+
+async def checked_async_items(iterator, check_item, item_error):
+    """
+    Iterate over an asynchronous iterator, checking each item when it is consumed
+    """
+    index = 0
+    async for item in iterator:
+        if not check_item(item):
+            raise item_error(index, item)
+        yield item
+        index += 1
+
+
+async def checked_invariants(coroutine_method, instance, args, kwargs, snapshot, check_invariants):
+    """
+    Await a coroutine method, and then check the invariants of its instance (unless it is a nested call on the same
+    instance, in the same task): snapshot is taken when the method starts, and None to check all the invariants
+    """
+    calls = _invariant_calls.get() if _invariant_calls is not None else frozenset()
+    key = id(instance)
+    if key in calls:
+        return await coroutine_method(instance, *args, **kwargs)
+    before = snapshot(instance) if snapshot is not None else None
+    token = _invariant_calls.set(calls | frozenset([key])) if _invariant_calls is not None else None
+    try:
+        ret = await coroutine_method(instance, *args, **kwargs)
+    finally:
+        if token is not None:
+            _invariant_calls.reset(token)
+    check_invariants(instance, before)
+    return ret
@@ -0,0 +1,98 @@
+import asyncio
+import inspect
+from unittest import TestCase
+
+from contracts import contract, contract_class, new_contract, ContractError
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class CoroutineTest(TestCase):
+    def setUp(self):
+        new_contract("int", lambda x: isinstance(x, int))
+
+    def test_arguments(self):
+        @contract(a='int')
+        async def f(a):
+            return a
+
+        self.assertTrue(inspect.iscoroutinefunction(f) or asyncio.iscoroutinefunction(f))
+        self.assertEqual(run(f(1)), 1)
+        # Raised when called, before any coroutine is created
+        self.assertRaises(ContractError, f, 'a')
+
+    def test_return_value(self):
+        @contract(_returns='int')
+        async def f(a):
+            await asyncio.sleep(0)
+            return a
+
+        self.assertEqual(run(f(1)), 1)
+        awaitable = f('a')
+        self.assertRaises(ContractError, run, awaitable)
+
+
+class AsyncGeneratorTest(TestCase):
+    def setUp(self):
+        new_contract("int", lambda x: isinstance(x, int))
+
+    @staticmethod
+    def collect(iterator, items):
+        async def consume():
+            async for item in iterator:
+                items.append(item)
+        return run(consume())
+
+    def test_items(self):
+        @contract(a='int', _returns='[int]')
+        async def f(a, *items):
+            for item in items:
+                await asyncio.sleep(0)
+                yield item
+
+        items = []
+        self.collect(f(1, 1, 2), items)
+        self.assertEqual(items, [1, 2])
+        items = []
+        with self.assertRaises(ContractError) as raised:
+            self.collect(f(1, 1, 'b', 3), items)
+        self.assertEqual(items, [1])
+        self.assertIn('item 1 of return value', str(raised.exception))
+        self.assertRaises(ContractError, f, 'a')
+
+
+class InvariantsTest(TestCase):
+    def test_coroutine_methods(self):
+        new_contract("non negative", lambda x: x >= 0)
+
+        @contract_class(_invariants=['n:non negative'])
+        class Counter(object):
+            def __init__(self, n):
+                self.n = n
+
+            async def decrement(self):
+                await asyncio.sleep(0)
+                self.n -= 1
+
+            async def decrement_twice(self):
+                self.n -= 2
+                await self.increment()
+
+            async def increment(self):
+                self.n += 1
+
+        counter = Counter(1)
+        run(counter.decrement())
+        self.assertEqual(counter.n, 0)
+        self.assertRaises(ContractError, run, counter.decrement())
+        self.assertEqual(counter.n, -1)
+        # The nested call does not check the invariants in the middle of the outer one
+        counter = Counter(1)
+        run(counter.decrement_twice())
+        self.assertEqual(counter.n, 0)
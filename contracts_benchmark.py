@@ -0,0 +1,195 @@
+"""
+Benchmarks of the overhead of contracts, to be compared against a stored baseline.
+
+Each benchmark measures the time per call of a decorated function (or per decoration), and its overhead against the
+same undecorated function:
+  - calls with simple, '|' and ',' assertions, with contracts enabled and disabled
+  - nested [...], {...} and member: assertions, _constraint and _returns
+  - sequence and mapping assertions on containers from 10 to 10^6 items, checked fully and sampled
+  - decoration time, eager and lazy, for large numbers of functions
+
+Usage:
+
+    python -m contracts_benchmark [--quick] [--output results.json] [--baseline baseline.json] [--tolerance 0.25]
+                                  [--repeat 5] [--duration 0.05]
+
+Results are printed, and written as JSON with --output. With --baseline, results are compared against a previous
+output: the exit code is 1 if any benchmark is slower than the baseline by more than the tolerance.
+"""
+
+import sys
+import json
+import timeit
+import argparse
+import platform
+
+import contracts
+import basic_contracts
+from contracts import contract, new_contract
+
+CONTAINER_SIZES = (10, 100, 1000, 10000, 100000, 1000000)
+QUICK_CONTAINER_SIZES = (10, 1000)
+DECORATION_COUNTS = (1000, 10000)
+QUICK_DECORATION_COUNTS = (100,)
+
+# Benchmarks faster than this are not reported as regressions, whatever the ratio: it is just noise
+MINIMUM_REGRESSION = 50e-9
+
+
+class Member(object):
+    def __init__(self, member):
+        self.member = member
+
+
+def _setup():
+    basic_contracts.setup()
+    new_contract('positive int', lambda x: isinstance(x, int) and x > 0)
+
+
+def _call_cases():
+    """
+    (name, contract arguments, arguments of the call)
+    """
+    items = list(range(1, 11))
+    return [
+        ('simple', dict(a='number'), (1, 2)),
+        ('or', dict(a='None|string|number'), (1, 2)),
+        ('and', dict(a='not None,number,positive int'), (1, 2)),
+        ('two parameters', dict(a='number', b='number'), (1, 2)),
+        ('sequence', dict(a='[positive int]'), (items, 2)),
+        ('mapping', dict(a='{positive int}'), (dict(zip(items, items)), 2)),
+        ('member', dict(a='member:positive int'), (Member(1), 2)),
+        ('nested', dict(a='[member:{positive int}]'), ([Member(dict(zip(items, items)))] * 10, 2)),
+        ('constraint', dict(_constraint='a < b'), (1, 2)),
+        ('returns', dict(_returns='number'), (1, 2)),
+    ]
+
+
+def _time_per_call(f, args, repeat, duration):
+    """
+    Best time per call, over repeat runs lasting about duration seconds each
+    """
+    timer = timeit.Timer(lambda: f(*args))
+    number = 1
+    elapsed = timer.timeit(number)
+    while elapsed < duration / 10:
+        number *= 10
+        elapsed = timer.timeit(number)
+    number = max(1, int(number * duration / elapsed))
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _measure(f, plain, args, repeat, duration):
+    elapsed = _time_per_call(f, args, repeat, duration)
+    return {'time': elapsed, 'overhead': elapsed - _time_per_call(plain, args, repeat, duration)}
+
+
+def bench_calls(repeat, duration):
+    def plain(a, b):
+        return a
+
+    results = {}
+    for name, assertion_list, args in _call_cases():
+        decorated = contract(**assertion_list)(plain)
+        results['call/%s/enabled' % name] = _measure(decorated, plain, args, repeat, duration)
+        contracts.set_enabled(False)
+        try:
+            results['call/%s/disabled' % name] = _measure(decorated, plain, args, repeat, duration)
+        finally:
+            contracts.set_enabled(True)
+    return results
+
+
+def bench_containers(sizes, repeat, duration):
+    def plain(a):
+        return a
+
+    results = {}
+    for assertion in ('[number]', '{number}', '[member:number]', '[number]~100', '{number}~100'):
+        decorated = contract(a=assertion)(plain)
+        for size in sizes:
+            if assertion.startswith('{'):
+                container = dict.fromkeys(range(size), 1)
+            elif 'member' in assertion:
+                container = [Member(1)] * size
+            else:
+                container = [1] * size
+            results['container/%s/%d' % (assertion, size)] = _measure(decorated, plain, (container,), repeat,
+                                                                      duration)
+    return results
+
+
+def _functions(count):
+    namespace = {}
+    exec('\n'.join('def f%d(a, b, c=None):\n    return a' % i for i in range(count)), namespace)
+    return [namespace['f%d' % i] for i in range(count)]
+
+
+def bench_decoration(counts, repeat):
+    assertion_lists = [dict(a='number'), dict(a='[string with text]', b='not None,number'),
+                       dict(a='[member:{positive int}]', _returns='number'), dict(c='None|string', _constraint='a<b')]
+    results = {}
+    for count in counts:
+        for lazy in (False, True):
+            def decorate_all():
+                for i, f in enumerate(_functions(count)):
+                    contract(_lazy=lazy, **assertion_lists[i % len(assertion_lists)])(f)
+
+            elapsed = min(timeit.repeat(decorate_all, number=1, repeat=repeat))
+            undecorated = min(timeit.repeat(lambda: _functions(count), number=1, repeat=repeat))
+            results['decoration/%s/%d' % ('lazy' if lazy else 'eager', count)] = {
+                'time': elapsed / count, 'overhead': (elapsed - undecorated) / count}
+    return results
+
+
+def run(quick=False, repeat=5, duration=0.05):
+    _setup()
+    results = {}
+    results.update(bench_calls(repeat, duration))
+    results.update(bench_containers(QUICK_CONTAINER_SIZES if quick else CONTAINER_SIZES, repeat, duration))
+    results.update(bench_decoration(QUICK_DECORATION_COUNTS if quick else DECORATION_COUNTS, repeat))
+    return {'python': platform.python_implementation() + ' ' + platform.python_version(), 'results': results}
+
+
+def compare(output, baseline, tolerance):
+    """
+    The benchmarks slower than in the baseline by more than tolerance (a ratio), as (name, baseline, current) times
+    """
+    regressions = []
+    for name, result in sorted(output['results'].items()):
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        if result['time'] > previous['time'] * (1 + tolerance) and \
+                result['time'] - previous['time'] > MINIMUM_REGRESSION:
+            regressions.append((name, previous['time'], result['time']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the overhead of contracts')
+    parser.add_argument('--quick', action='store_true', help='smaller containers and fewer decorated functions')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions of each measure (the best one is kept)')
+    parser.add_argument('--duration', type=float, default=0.05, help='approximate seconds of each measure')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='slowdown ratio allowed against the baseline')
+    args = parser.parse_args(argv)
+
+    output = run(args.quick, args.repeat, args.duration)
+    for name, result in sorted(output['results'].items()):
+        print('%-45s %12.3f us %12.3f us overhead' % (name, result['time'] * 1e6, result['overhead'] * 1e6))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(output, json.load(baseline_file), args.tolerance)
+        for name, previous, current in regressions:
+            print('REGRESSION %s: %.3f us -> %.3f us' % (name, previous * 1e6, current * 1e6))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+from unittest import TestCase
+
+import contracts_benchmark
+
+
+class CompareTest(TestCase):
+    @staticmethod
+    def _output(**times):
+        return {'results': dict((name, {'time': time, 'overhead': time}) for name, time in times.items())}
+
+    def test_no_regression(self):
+        baseline = self._output(a=1e-6, b=1e-6)
+        self.assertEqual(contracts_benchmark.compare(self._output(a=1.2e-6, b=0.5e-6), baseline, 0.25), [])
+
+    def test_regression(self):
+        baseline = self._output(a=1e-6, b=1e-6)
+        self.assertEqual(contracts_benchmark.compare(self._output(a=2e-6, b=1e-6, c=1.0), baseline, 0.25),
+                         [('a', 1e-6, 2e-6)])
+
+    def test_noise(self):
+        baseline = self._output(a=1e-8)
+        self.assertEqual(contracts_benchmark.compare(self._output(a=3e-8), baseline, 0.25), [])
+
+
+class RunTest(TestCase):
+    def test_containers(self):
+        contracts_benchmark._setup()
+        results = contracts_benchmark.bench_containers((10,), 1, 0.001)
+        self.assertEqual(sorted(results), ['container/[member:number]/10', 'container/[number]/10',
+                                           'container/[number]~100/10', 'container/{number}/10',
+                                           'container/{number}~100/10'])
+        self.assertGreater(results['container/[number]/10']['time'], 0)
@@ -1,5 +1,8 @@
+import os
 import sys
-from unittest import TestCase
+import json
+import inspect
+from unittest import TestCase, skipIf
 
 from contracts import GenericAssertion, SimpleAssertion, SequenceAssertion, MappingAssertion, MemberAssertion
 from contracts import parse_assertion, ContractParseError, new_contract, ContractError, contract
@@ -54,6 +57,16 @@ class ParseTest(TestCase):
         self.check_nested_assertions(res.assertions[0], [SequenceAssertion, MemberAssertion,
                                                          SimpleAssertion])
 
+    def test_sampled(self):
+        res = parse_assertion("[test assertion]~10")
+        self.check_nested_assertions(res.assertions[0], [SequenceAssertion, SimpleAssertion])
+        self.assertEqual(res.assertions[0].sample_size, 10)
+        res = parse_assertion("{[test assertion]}~10")
+        self.check_nested_assertions(res.assertions[0], [MappingAssertion, SequenceAssertion, SimpleAssertion])
+        self.assertEqual(res.assertions[0].sample_size, 10)
+        self.assertIsNone(res.assertions[0].internal_assertion.sample_size)
+        self.assertRaises(ContractParseError, parse_assertion, "[test assertion]~1")
+
     def test_list_in_member(self):
         res = parse_assertion("member:[test assertion]")
         self.assertEqual(res.count, 1)
@@ -92,8 +105,98 @@ class ParseTest(TestCase):
         self.check_nested_assertions(res.assertions[0], [SequenceAssertion, MemberAssertion, SimpleAssertion])
         self.check_nested_assertions(res.assertions[1], [MemberAssertion, SequenceAssertion, SimpleAssertion])
 
-    def test_cannot_do_and_or(self):
-        self.assertRaises(ContractParseError, parse_assertion, "test assertion,test assertion|test assertion")
+    def test_shared(self):
+        self.assertIs(parse_assertion("[test assertion]"), parse_assertion("[test assertion]"))
+        self.assertEqual(parse_assertion("[test assertion],member:test assertion").contract_names,
+                         frozenset(["test assertion"]))
+
+    def test_redefinition(self):
+        res = parse_assertion("[test assertion]")
+        new_contract("test assertion", lambda x: False)
+        redefined = parse_assertion("[test assertion]")
+        self.assertIsNot(res, redefined)
+        self.assertFalse(redefined.check([1]))
+
+    def test_parse_cache(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+        try:
+            cache = contracts.set_parse_cache(directory)
+            contracts._parsed_assertions.clear()
+            text = "[test assertion|member:test assertion]~5,{test assertion}"
+            parsed = parse_assertion(text)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            cache.save()
+            self.assertEqual(os.listdir(directory), [os.path.basename(cache.path)])
+            # A new process: the assertion is loaded from the file
+            cache = contracts.set_parse_cache(directory)
+            contracts._parsed_assertions.clear()
+            loaded = parse_assertion(text)
+            self.assertIs(loaded, parsed)  # interned
+            self.assertEqual(loaded.assertions[0].sample_size, 5)
+            self.assertEqual(cache.hits, 1)
+            # Redefined contracts make the entries stale
+            new_contract("test assertion", lambda x: x is not None)
+            cache = contracts.set_parse_cache(directory)
+            contracts._parsed_assertions.clear()
+            self.assertFalse(parse_assertion(text).check({1: None}))
+            self.assertEqual((cache.hits, cache.stale), (0, 1))
+        finally:
+            contracts.set_parse_cache(None)
+            shutil.rmtree(directory)
+
+    def test_interned(self):
+        res = parse_assertion("[test assertion],member:test assertion")
+        other = parse_assertion("member:[test assertion]|test assertion")
+        self.assertIs(res.assertions[0], other.assertions[0].internal_assertion)
+        self.assertIs(res.assertions[1].internal_assertion, other.assertions[1])
+        self.assertIs(parse_assertion("([test assertion])").assertions[0], res.assertions[0])
+        self.assertRaises(AttributeError, setattr, res, 'all_required', False)
+        self.assertRaises(AttributeError, setattr, res.assertions[0], 'extra', 1)
+
+    def test_memory_report(self):
+        @contract(a="[test assertion]", b="member:[test assertion]")
+        def f(a, b):
+            pass
+
+        @contract(a="[test assertion]")
+        def g(a):
+            pass
+
+        report = contracts.memory_report()
+        self.assertGreaterEqual(report['functions'], 2)
+        self.assertGreater(report['references'], report['nodes'])
+        self.assertGreaterEqual(report['shared'], 2)
+        self.assertGreater(report['bytes'], 0)
+        self.assertIn('SimpleAssertion', report['by_type'])
+
+    def test_and_or(self):
+        res = parse_assertion("test assertion,member:test assertion|[test assertion]")
+        self.assertFalse(res.all_required)
+        self.assertTrue(res.assertions[0].all_required)
+        self.check_nested_assertions(res.assertions[0].assertions[1], [MemberAssertion, SimpleAssertion])
+        self.check_nested_assertions(res.assertions[1], [SequenceAssertion, SimpleAssertion])
+        res = parse_assertion("test assertion,(test assertion|test assertion)")
+        self.assertTrue(res.all_required)
+        self.assertFalse(res.assertions[1].all_required)
+        self.assertEqual(str(parse_assertion("[ (test assertion) ]")), "[test assertion]")
+
+    def test_nested_operators(self):
+        res = parse_assertion("[test assertion|member:test assertion],{test assertion,test assertion}")
+        self.assertEqual(res.count, 2)
+        self.assertEqual(res.assertions[0].internal_assertion.count, 2)
+        self.assertFalse(res.assertions[0].internal_assertion.all_required)
+        self.assertTrue(res.assertions[1].internal_assertion.all_required)
+
+    def test_parse_errors(self):
+        for assertion, position in (("[test assertion", 15), ("test assertion]", 14), ("", 0),
+                                    ("test assertion,|test assertion", 15), ("(test assertion", 15),
+                                    ("[test assertion]~x", 17), ("member:", 7), ("undefined", 0),
+                                    ("test assertion~2", 14)):
+            with self.assertRaises(ContractParseError) as raised:
+                parse_assertion(assertion)
+            self.assertIn('at position %d' % position, str(raised.exception))
 
 
 class ParseActionTest(TestCase):
@@ -170,6 +273,227 @@ class ParseActionTest(TestCase):
         self.assertFalse(parse_assertion("{always true}").check(1))
 
 
+    def test_compiled(self):
+        class Item(object):
+            def __init__(self, member):
+                self.member = member
+
+        res = parse_assertion("[member:{pass-through}]")
+        self.assertIs(res.compiled, res.compiled)
+        self.assertTrue(res.compiled([Item({1: True}), Item({})]))
+        self.assertFalse(res.compiled([Item({1: True}), Item({2: False})]))
+        self.assertFalse(res.compiled([Item({1: True}), object()]))
+        self.assertTrue(parse_assertion("[pass-through]|always true").compiled([False]))
+        self.assertIs(parse_assertion("pass-through").compiled(1), True)
+
+    def test_check_many(self):
+        class Record(object):
+            def __init__(self, items):
+                self.items = items
+
+        new_contract("positive", lambda x: x > 0)
+        records = [Record([1, 2]), Record([1, -2]), 3, Record({'a': [1], 'b': [0]}), Record(None)]
+        report = contracts.check_many("items:[positive]|items:{[positive]}", records)
+        self.assertEqual((report.checked, report.failed, report.passed), (5, 4, 1))
+        self.assertEqual(report.failing_indices, [1, 2, 3, 4])
+        self.assertFalse(report)
+        report = contracts.check_many("items:{[positive]}", records)
+        self.assertEqual(report.failures, [(0, '.items'), (1, '.items'), (2, '.items'), (3, ".items{'b'}[0]"),
+                                           (4, '.items')])
+        report = contracts.check_many("[positive],[pass-through]", iter([[1, 2], [3, 0], {0: 1}, [-1]]),
+                                      max_failures=2)
+        self.assertEqual(report.failures, [(1, '[1]'), (2, '[key 0]')])
+        self.assertEqual((report.checked, report.failed, report.truncated), (4, 3, True))
+        self.assertTrue(contracts.check_many("positive", (n + 1 for n in range(1000))))
+        failures = contracts.iter_failures("positive", (n % 3 for n in range(10 ** 9)))
+        self.assertEqual([next(failures) for _ in range(3)], [(0, ''), (3, ''), (6, '')])
+
+    def test_check_columns(self):
+        from array import array
+        new_contract("positive", lambda x: x > 0, lambda buffer: None)
+        reports = contracts.check_columns({'a': 'positive', 'b': 'positive|always true'},
+                                          {'a': array('i', [1, 0, 2, -1]), 'b': [0, 1, 2, 3]})
+        self.assertEqual(reports['a'].failures, [(1, ''), (3, '')])
+        self.assertEqual((reports['b'].checked, reports['b'].failed), (4, 0))
+
+    def test_types(self):
+        class Integer(int):
+            pass
+
+        new_contract("int type", types=int)
+        new_contract("none type", types=type(None))
+        new_contract("float or string", types=(float, str))
+        self.assertTrue(parse_assertion("int type").check(1))
+        self.assertTrue(parse_assertion("int type").check(Integer(1)))
+        self.assertFalse(parse_assertion("int type").check('1'))
+        self.assertTrue(contracts._defined_contracts["int type"](True))
+        res = parse_assertion("none type|int type|float or string")
+        self.assertEqual([res.check(v) for v in (None, 1, 1.0, 'a', b'a', [])], [True, True, True, True, False, False])
+        res = parse_assertion("none type|always false|[always true]|int type")
+        self.assertEqual([res.check(v) for v in (None, 1, [1], ('a',), object())], [True, True, True, True, False])
+        self.assertEqual([parse_assertion("[int type]").check(v) for v in ([1, True], [1, None])], [True, False])
+        self.assertRaises(ValueError, new_contract, "no assertion")
+
+    def test_families(self):
+        calls = []
+
+        def between(minimum, maximum):
+            calls.append((minimum, maximum))
+            return lambda x: minimum <= x <= maximum
+
+        contracts.new_contract_family("between", between)
+        res = parse_assertion("between(1, 10)")
+        self.assertEqual(str(res), "between(1,10)")
+        self.assertEqual([res.check(v) for v in (0, 1, 10, 11)], [False, True, True, False])
+        self.assertIs(parse_assertion("[between(1,10)]").assertions[0].internal_assertion, res.assertions[0])
+        self.assertEqual(calls, [(1, 10)])
+        self.assertIsNot(parse_assertion("between(1.0,10)").assertions[0], res.assertions[0])
+        self.assertEqual(parse_assertion("between(a,z)").assertions[0].arguments, ('a', 'z'))
+        self.assertRaises(ContractParseError, parse_assertion, "undefined family(1)")
+        self.assertRaises(ContractParseError, parse_assertion, "between(1)")
+        self.assertRaises(ContractParseError, parse_assertion, "between(1,")
+
+        @contract(a="between(1,10)")
+        def f(a):
+            return a
+        f(5)
+        contracts.new_contract_family("between", lambda minimum, maximum: lambda x: minimum < x < maximum)
+        self.assertRaises(ContractError, f, 10)
+        self.assertFalse(parse_assertion("between(1,10)").check(1))
+
+    def test_adaptive(self):
+        new_contract("expensive", lambda x: sum(range(1000)) < 0)
+        new_contract("cheap", lambda x: x is None)
+        period = contracts.adaptive_period
+        contracts.adaptive_period = 4
+        contracts.set_adaptive(True)
+        try:
+            res = parse_assertion("expensive|cheap")
+            self.assertEqual([b.assertion for b in contracts.adaptive_stats(res)], ['expensive', 'cheap'])
+            for _ in range(9):
+                self.assertTrue(res.check(None))
+                self.assertFalse(res.check(1))
+            stats = contracts.adaptive_stats("expensive|cheap")
+            self.assertEqual([b.assertion for b in stats], ['cheap', 'expensive'])
+            self.assertEqual([(b.calls, b.passed) for b in stats], [(5, 5), (5, 0)])
+            self.assertEqual(str(stats[0]).split(',')[:2], ["BranchStats('cheap'", ' calls=5'])
+            res = parse_assertion("expensive,real:cheap")
+            for _ in range(9):
+                self.assertFalse(res.check(None))
+            self.assertEqual([b.assertion for b in contracts.adaptive_stats(res)], ['real:cheap', 'expensive'])
+            # Exceptions (here, a missing member) only fail their branch, whatever the order
+            res = parse_assertion("member:cheap|cheap")
+            self.assertEqual([res.check(None) for _ in range(9)], [True] * 9)
+        finally:
+            contracts.set_adaptive(False)
+            contracts.adaptive_period = period
+        self.assertIsNone(contracts.adaptive_stats("expensive|cheap"))
+        self.assertEqual([parse_assertion(a).check(None) for a in ("member:cheap|cheap", "cheap|member:cheap")],
+                         [True, True])
+
+    def test_adaptive_threads(self):
+        import threading
+        new_contract("first", lambda x: x > 0)
+        new_contract("second", lambda x: x < 100)
+        period = contracts.adaptive_period
+        contracts.adaptive_period = 1
+        contracts.set_adaptive(True)
+        results = []
+        try:
+            res = parse_assertion("first,second")
+            threads = [threading.Thread(target=lambda: results.extend(res.check(-5) for _ in range(5000)))
+                       for _ in range(4)]
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            for thread in threads:
+                thread.join(60)
+        finally:
+            contracts.set_adaptive(False)
+            contracts.adaptive_period = period
+        self.assertEqual(results, [False] * 20000)
+
+    def test_parallel(self):
+        import threading
+        threads = set()
+        new_contract("parallel", lambda x: threads.add(threading.current_thread()) or x >= 0, parallel='thread')
+        threshold, chunk_size = contracts.parallel_threshold, contracts.parallel_chunk_size
+        contracts.parallel_threshold, contracts.parallel_chunk_size = 100, 10
+        try:
+            res = parse_assertion("[parallel]")
+            self.assertTrue(res.check(list(range(10))))
+            self.assertEqual(threads, set([threading.current_thread()]))
+            threads.clear()
+            self.assertTrue(res.check(list(range(1000))))
+            self.assertNotIn(threading.current_thread(), threads)
+            self.assertFalse(res.check(list(range(1000)) + [-1]))
+            self.assertTrue(parse_assertion("{parallel}").check(dict.fromkeys(range(1000), 1)))
+            self.assertFalse(parse_assertion("{parallel}").check(dict.fromkeys(range(1000), -1)))
+            new_contract("digits", str.isdigit, parallel='process')
+            self.assertTrue(parse_assertion("[digits]").check(['1'] * 1000))
+            self.assertFalse(parse_assertion("[digits]").check(['1'] * 999 + ['a']))
+            # Lambdas can't be pickled: they are checked serially
+            new_contract("local", lambda x: x >= 0, parallel='process')
+            self.assertTrue(parse_assertion("[local]").check(list(range(1000))))
+            self.assertFalse(parse_assertion("[local]").check(list(range(1000)) + [-1]))
+        finally:
+            contracts.parallel_threshold, contracts.parallel_chunk_size = threshold, chunk_size
+        self.assertRaises(ValueError, new_contract, "parallel", lambda x: True, parallel='gpu')
+
+    def test_nested_parallel(self):
+        import threading
+        new_contract("leaf", lambda x: x >= 0, parallel='thread')
+        new_contract("record", lambda r: parse_assertion("[leaf]").check(r), parallel='thread')
+        threshold, chunk_size = contracts.parallel_threshold, contracts.parallel_chunk_size
+        contracts.parallel_threshold, contracts.parallel_chunk_size = 100, 10
+        results = []
+        try:
+            records = [list(range(100))] * 500
+            res = parse_assertion("[record]")
+            checker = threading.Thread(target=lambda: results.extend([res.check(records),
+                                                                      res.check(records + [[-1] * 100])]))
+            checker.daemon = True
+            checker.start()
+            checker.join(30)
+        finally:
+            contracts.parallel_threshold, contracts.parallel_chunk_size = threshold, chunk_size
+        self.assertEqual(results, [True, False])
+
+    def test_vectorized(self):
+        from array import array
+        checked = []
+        new_contract("vectorized", lambda x: checked.append(x) or x > 0,
+                     lambda buffer: None if buffer.typecode == 'd' else all(x > 0 for x in buffer))
+        res = parse_assertion("[vectorized]")
+        self.assertTrue(res.check(array('i', [1, 2])))
+        self.assertFalse(res.check(array('i', [1, 0])))
+        self.assertEqual(checked, [])
+        self.assertTrue(res.check(array('d', [1, 2])))
+        self.assertEqual(checked, [1, 2])
+        self.assertTrue(res.check([3]))
+        self.assertEqual(checked, [1, 2, 3])
+
+    def test_sampled(self):
+        checked = []
+        new_contract("recorded", lambda x: checked.append(x) or x >= 0)
+        items = list(range(1000))
+        self.assertTrue(parse_assertion("[recorded]~10").check(items))
+        self.assertEqual(len(checked), 10)
+        self.assertEqual((checked[0], checked[-1]), (0, 999))
+        self.assertEqual(len(set(checked)), 10)
+        del checked[:]
+        self.assertTrue(parse_assertion("{recorded}~10").check(dict(zip(items, items))))
+        self.assertEqual(len(checked), 10)
+        self.assertEqual((checked[0], checked[-1]), (0, 999))
+        del checked[:]
+        self.assertTrue(parse_assertion("[recorded]~10").check(dict.fromkeys(items)))
+        self.assertEqual(len(checked), 10)
+        del checked[:]
+        self.assertTrue(parse_assertion("[recorded]~10").check(items[:5]))
+        self.assertEqual(checked, items[:5])
+        self.assertFalse(parse_assertion("[recorded]~2").check(items + [-1]))
+        self.assertFalse(parse_assertion("[recorded]~2").check(None))
+
 # noinspection PyUnresolvedReferences
 class IronPythonSpecificTest(TestCase):
     def setUp(self):
@@ -233,6 +557,31 @@ class CheckContractTest(TestCase):
         self.assertRaises(ContractError, f, 'a', 'b')
         self.assertRaises(ContractError, f, 'a', 1)
 
+    def test_defaults_and_variable_arguments(self):
+        @contract(a='int', b='int', c='int', args='[int]', kwargs='{int}')
+        def f(a, b=1, *args, c=2, **kwargs):
+            return a + b + sum(args) + c + sum(kwargs.values())
+
+        self.assertEqual(f(1), 4)
+        self.assertEqual(f(1, 2, 3, c=4, d=5), 15)
+        self.assertEqual(f(b=2, a=1), 5)
+        self.assertRaises(ContractError, f, 1, 'b')
+        self.assertRaises(ContractError, f, 1, 2, 'x')
+        self.assertRaises(ContractError, f, 1, c='c')
+        self.assertRaises(ContractError, f, 1, d='d')
+        self.assertRaises(TypeError, f, 1, a=1)
+
+    @skipIf(sys.version_info < (3, 8), 'positional-only parameters need Python 3.8')
+    def test_positional_only_arguments(self):
+        namespace = {}
+        exec('def f(a, /, b=1, *args, c=2):\n    return a + b + sum(args) + c', namespace)
+        f = contract(a='int', b='int', args='[int]', c='int')(namespace['f'])
+        self.assertEqual(f(1), 4)
+        self.assertEqual(f(1, 2, 3, c=4), 10)
+        self.assertRaises(ContractError, f, 'a')
+        self.assertRaises(TypeError, f, a=1)
+        self.assertEqual(str(inspect.signature(f)), '(a, /, b=1, *args, c=2)')
+
     def test_return_value(self):
         @contract(_returns='int')
         def f(a):
@@ -249,6 +598,25 @@ class CheckContractTest(TestCase):
         self.assertEqual(f(1, 2), 3)
         self.assertRaises(ContractError, f, 2, 1)
 
+    def test_constraint_only_binds_referenced_parameters(self):
+        @contract(a='int', _constraint='all(x < a for x in args) and len(kwargs) < 2')
+        def f(a, b, *args, **kwargs):
+            return a
+
+        self.assertEqual(f(3, 'b', 1, 2, c=1), 3)
+        self.assertRaises(ContractError, f, 3, 'b', 1, 4)
+        self.assertRaises(ContractError, f, 3, 'b', c=1, d=2)
+        self.assertRaises(ContractError, f, 'a', 'b')
+
+    def test_invalid_constraint(self):
+        self.assertRaises(ContractParseError, contract, _constraint='a <')
+
+        def f(a, b):
+            return a
+
+        self.assertRaises(ContractParseError, contract(_constraint='a < c'), f)
+        self.assertEqual(contract(_constraint='a.real < b')(f)(1, 2), 1)
+
     def test_disabled(self):
 
         @contract(a='int')
@@ -263,6 +631,477 @@ class CheckContractTest(TestCase):
         self.assertEqual(f(1), 1)
         self.assertRaises(ContractError, f, 'a')
 
+    def test_disabled_calls_original_function(self):
+        def f(a):
+            return a
+
+        g = contract(a='int')(f)
+        contracts.set_enabled(False)
+        try:
+            self.assertIs(g.__globals__['_call_'], f)
+        finally:
+            contracts.set_enabled(True)
+        self.assertIsNot(g.__globals__['_call_'], f)
+        self.assertRaises(ContractError, g, 'a')
+
+    def test_stripped(self):
+        def f(a):
+            return a
+
+        contracts.stripped = True
+        try:
+            self.assertIs(contract(a='undefined contract')(f), f)
+        finally:
+            contracts.stripped = False
+        self.assertIsNot(contract(a='int')(f), f)
+
+    def test_redefined_contract(self):
+        new_contract('small', lambda x: x < 10)
+
+        @contract(a='[small]', _returns='small')
+        def f(a):
+            return len(a)
+
+        self.assertEqual(f([5]), 1)
+        new_contract('small', lambda x: x < 1)
+        self.assertRaises(ContractError, f, [5])
+        self.assertRaises(ContractError, f, [0])
+        self.assertEqual(f([]), 0)
+
+    def test_lazy(self):
+        @contract(a='lazy int', _lazy=True)
+        def f(a):
+            return a
+
+        self.assertTrue(f.__contract__.pending)
+        new_contract('lazy int', lambda x: isinstance(x, int))
+        self.assertEqual(f(1), 1)
+        self.assertFalse(f.__contract__.pending)
+        self.assertRaises(ContractError, f, 'a')
+
+    def test_lazy_errors(self):
+        @contract(a='undefined lazy contract', _lazy=True)
+        def f(a):
+            return a
+
+        self.assertRaises(ContractParseError, f, 1)
+        self.assertRaises(ContractParseError, f, 1)
+        errors = contracts.warm_up(raise_errors=False)
+        self.assertIn(f.__wrapped__, [function for function, _ in errors])
+        self.assertRaises(ContractParseError, contracts.warm_up)
+        new_contract('undefined lazy contract', lambda x: x > 0)
+        contracts.warm_up()
+        self.assertFalse(f.__contract__.pending)
+        self.assertRaises(ContractError, f, 0)
+
+    def test_lazy_invariants(self):
+        contracts.lazy = True
+        try:
+            @contracts.contract_class(_invariants=['value:later contract'])
+            class Later(object):
+                def __init__(self, value):
+                    self.value = value
+        finally:
+            contracts.lazy = False
+        self.assertRaises(ContractParseError, Later, 1)
+        errors = contracts.warm_up(raise_errors=False)
+        self.assertIn(Later, [owner for owner, _ in errors])
+        new_contract('later contract', lambda x: x > 0)
+        Later(1)
+        self.assertRaises(ContractError, Later, 0)
+        contracts.warm_up()
+
+    def test_sampling(self):
+        @contract(a='int', _sample=3)
+        def f(a):
+            return a
+
+        results = []
+        for _ in range(6):
+            try:
+                results.append(f('a'))
+            except ContractError:
+                results.append(None)
+        self.assertEqual(results, [None, 'a', 'a', None, 'a', 'a'])
+        stats = contracts.sampling_stats(f)
+        self.assertEqual((stats.calls, stats.checked), (6, 2))
+        self.assertIs(contracts.sampling_stats()[f.__module__ + '.' + f.__qualname__], stats)
+
+    def test_sampling_policies(self):
+        @contract(a='int', _sample=contracts.Probability(0.0))
+        def never(a):
+            return a
+
+        @contract(a='int', _sample=contracts.TimeBudget(1000))
+        def budget(a):
+            return a
+
+        self.assertEqual(never('a'), 'a')
+        self.assertRaises(ContractError, budget, 'a')
+        self.assertEqual(contracts.sampling_stats(budget).checked, 1)
+        self.assertIsNone(contracts.sampling_stats(contract(a='int')(lambda a: a)))
+        self.assertRaises(ContractParseError, contract, a='int', _sample='sometimes')
+
+    def test_policy(self):
+        @contract(a='int', _returns='int')
+        def hot(a):
+            return str(a)
+
+        @contract(a='int', _lazy=True)
+        def cold(a):
+            return a
+
+        name = hot.__module__ + '.' + hot.__qualname__
+        try:
+            rules = contracts.set_policy('# comment\n*.cold = off; %s = args-only; %s=sampled:2' % (name, name))
+            self.assertEqual(rules, [('*.cold', 'off'), (name, 'args-only'), (name, 'sampled:2')])
+            self.assertEqual(hot(1), '1')
+            self.assertRaises(ContractError, hot, 'a')
+            self.assertEqual(cold('a'), 'a')
+            self.assertTrue(cold.__contract__.pending)
+
+            contracts.set_policy([(hot.__module__, 'sampled:2')])
+            self.assertRaises(ContractError, cold, 'a')
+            self.assertEqual(cold('a'), 'a')
+            self.assertEqual(contracts.sampling_stats(cold).calls, 2)
+
+            os.environ['SIMPLE_CONTRACTS_POLICY'] = '%s = full' % name
+            contracts.reload_policy()
+            self.assertRaises(ContractError, hot, 1)
+            self.assertRaises(ContractError, cold, 'a')
+
+            for rules in ('%s' % name, '* = sometimes', '* = off:2', '* = sampled:0'):
+                self.assertRaises(ContractParseError, contracts.set_policy, rules)
+        finally:
+            os.environ.pop('SIMPLE_CONTRACTS_POLICY', None)
+            self.assertEqual(contracts.reload_policy(), [])
+        self.assertRaises(ContractError, hot, 1)
+
+    def test_policy_of_classes(self):
+        new_contract('positive', lambda x: x > 0)
+
+        @contracts.contract_class(amount='int', _invariants=['balance:positive'])
+        class Hot(object):
+            def __init__(self, balance):
+                self.balance = balance
+
+            def withdraw(self, amount):
+                self.balance -= amount
+                return self.balance
+
+        name = Hot.__module__ + '.' + Hot.__qualname__
+        try:
+            contracts.set_policy('%s.* = off' % name)
+            self.assertEqual(Hot(-1).withdraw(1), -2)
+            self.assertRaises(TypeError, Hot(1).withdraw, 'a')
+            contracts.set_policy('%s.withdraw = args-only' % name)
+            self.assertRaises(ContractError, Hot, -1)
+            self.assertEqual(Hot(1).withdraw(2), -1)
+            self.assertRaises(ContractError, Hot(1).withdraw, 'a')
+            contracts.set_policy('%s.withdraw = sampled:2' % name)
+            hot = Hot(10)
+            self.assertRaises(ContractError, hot.withdraw, 20)
+            self.assertEqual(hot.withdraw(1), -11)
+            self.assertRaises(ContractError, hot.withdraw, 1)
+        finally:
+            contracts.set_policy(None)
+        self.assertRaises(ContractError, Hot(1).withdraw, 2)
+
+    def test_instrumentation(self):
+        @contract(a='[int]', b='int', _constraint='len(a) < b', _returns='int')
+        def f(a, b):
+            return b
+
+        self.assertIsNone(contracts.get_instrumentation())
+        instrumentation = contracts.set_instrumentation(True)
+        try:
+            f([1, 2], 3)
+            self.assertRaises(ContractError, f, [1], 'b')
+            name = f.__module__ + '.' + f.__qualname__
+            self.assertEqual((instrumentation.functions[name].passed, instrumentation.functions[name].failed), (1, 1))
+            self.assertEqual(instrumentation.parameters[(name, 'a')].calls, 2)
+            self.assertEqual(instrumentation.parameters[(name, 'b')].failed, 1)
+            self.assertEqual(instrumentation.parameters[(name, '_constraint')].calls, 1)
+            self.assertEqual(instrumentation.parameters[(name, '_returns')].passed, 1)
+            self.assertEqual(instrumentation.contracts['int'].calls, 6)
+            report = json.loads(instrumentation.to_json())
+            self.assertEqual(report['parameters'][name]['a']['calls'], 2)
+            self.assertEqual(sum(report['contracts']['int']['histogram']), 6)
+            prometheus = instrumentation.to_prometheus()
+            self.assertIn('contracts_contract_check_total{contract="int",result="passed"} 5', prometheus)
+            self.assertIn('contracts_function_check_seconds_count{function="%s"} 2' % name, prometheus)
+        finally:
+            contracts.set_instrumentation(False)
+        self.assertIs(f.__globals__['_call_'], f.__contract__.checked_call)
+        self.assertEqual(f.__contract__.checked_call.__name__, '_contract_with_return')
+
+    def test_check_cache(self):
+        checked = []
+        new_contract('recorded int', lambda x: checked.append(x) or isinstance(x, int))
+
+        @contract(a='recorded int|[recorded int]')
+        def f(a):
+            return a
+
+        self.assertIsNone(contracts.get_check_cache())
+        cache = contracts.set_check_cache(2)
+        try:
+            f(1)
+            f(1)
+            self.assertEqual(checked, [1])
+            self.assertRaises(ContractError, f, 1.0)
+            self.assertRaises(ContractError, f, 1.0)
+            self.assertEqual(len(checked), 3)
+            f((1, 2))
+            f((1, 2))
+            self.assertEqual(len(checked), 6)
+            self.assertRaises(ContractError, f, (1.0, 2))
+            del checked[:]
+            f([3])
+            f([3])
+            self.assertEqual(checked, [[3], 3, [3], 3])
+            self.assertEqual((cache.hits, cache.size, cache.evictions), (2, 2, 0))
+            f(4)
+            self.assertEqual((cache.size, cache.evictions), (2, 1))
+            del checked[:]
+            f(1)
+            self.assertEqual(checked, [1])
+            new_contract('recorded int', lambda x: isinstance(x, int) and x > 1)
+            self.assertEqual(cache.size, 0)
+            self.assertRaises(ContractError, f, 1)
+        finally:
+            contracts.set_check_cache(None)
+        self.assertEqual(f.__contract__.checked_call.__name__, '_contract')
+
+    def test_check_cache_signed_zero(self):
+        import math
+        new_contract('positive sign', lambda x: math.copysign(1.0, x.real) > 0 and math.copysign(1.0, x.imag) > 0)
+
+        @contract(a='positive sign')
+        def f(a):
+            return a
+
+        contracts.set_check_cache(10)
+        try:
+            f(0.0)
+            self.assertRaises(ContractError, f, -0.0)
+            f(complex(0.0, 0.0))
+            self.assertRaises(ContractError, f, complex(0.0, -0.0))
+        finally:
+            contracts.set_check_cache(None)
+
+    def test_deferred(self):
+        violations = []
+        validator = contracts.DeferredValidator(handler=lambda f, e: violations.append((f.__name__, str(e))))
+
+        @contract(a='int', _constraint='a < b', _returns='int', _deferred=validator)
+        def f(a, b):
+            return b
+
+        self.assertEqual(f(1, 2), 2)
+        self.assertEqual(f('a', 2), 2)
+        self.assertEqual(f(3, 2), 2)
+        self.assertTrue(validator.flush(5))
+        self.assertEqual((validator.captured, validator.checked, validator.violations), (3, 3, 2))
+        self.assertEqual([name for name, _ in violations], ['f', 'f'])
+        self.assertIn('parameter a', violations[0][1])
+        self.assertIn('general constraint', violations[1][1])
+        self.assertIs(contract(a='int', _deferred=True)(f).__contract__.deferred, contracts.get_deferred_validator())
+        self.assertRaises(ContractParseError, contract, a='int', _deferred='later')
+
+    def test_deferred_snapshot(self):
+        import copy
+        import threading
+        violations = []
+        validator = contracts.DeferredValidator(handler=lambda f, e: violations.append(str(e)), snapshot=copy.deepcopy)
+
+        @contract(a='[int]', b='not None', _deferred=validator)
+        def f(a, b=None, c=None):
+            a.append('x')
+            return a
+
+        self.assertEqual(f([1], 1, threading.Lock()), [1, 'x'])
+        self.assertEqual(f([2], threading.Lock()), [2, 'x'])
+        self.assertRaises(TypeError, f)
+        self.assertTrue(validator.flush(5))
+        self.assertEqual((validator.captured, validator.violations, validator.snapshot_failures), (2, 0, 1))
+        f([3], None)
+        self.assertTrue(validator.flush(5))
+        self.assertEqual(len(violations), 1)
+        self.assertIn('parameter b', violations[0])
+
+    def test_deferred_full_buffer(self):
+        import threading
+        handling, release = threading.Event(), threading.Event()
+
+        def handler(f, e):
+            handling.set()
+            release.wait(5)
+
+        validator = contracts.DeferredValidator(capacity=1, handler=handler)
+
+        @contract(a='int', _deferred=validator)
+        def f(a):
+            return a
+
+        f('a')
+        self.assertTrue(handling.wait(5))
+        f(1)
+        f(2)
+        self.assertEqual((validator.captured, validator.dropped, validator.pending), (2, 1, 2))
+        release.set()
+        self.assertTrue(validator.flush(5))
+        self.assertEqual((validator.checked, validator.violations, validator.pending), (2, 1, 0))
+
+    def test_class_contract(self):
+        checked = []
+        new_contract('recorded', lambda x: checked.append(x) or x >= 0)
+
+        @contracts.contract_class(amount='int', _invariants=['balance:recorded', 'history:[int]'],
+                                  _methods={'withdraw': dict(_constraint='amount <= self.balance')})
+        class Account(object):
+            def __init__(self, balance):
+                self.balance = balance
+                self.history = []
+
+            def deposit(self, amount):
+                self.balance += amount
+
+            def withdraw(self, amount):
+                self.balance -= amount
+
+            def log(self, entry):
+                self.history = self.history + [entry]
+
+            def owner(self):
+                return 'me'
+
+        account = Account(10)
+        self.assertEqual(checked, [10])
+        account.deposit(5)
+        self.assertEqual(checked, [10, 15])
+        self.assertEqual(account.owner(), 'me')
+        account.log(1)
+        self.assertEqual(checked, [10, 15])
+        self.assertRaises(ContractError, account.deposit, 'a')
+        self.assertRaises(ContractError, account.withdraw, 20)
+        with self.assertRaises(ContractError) as raised:
+            account.deposit(-20)
+        self.assertIn("invariant 'balance:recorded' of class Account after deposit", str(raised.exception))
+        self.assertRaises(ContractError, account.log, 'a')
+        self.assertRaises(ContractError, Account, -1)
+        account.balance = -1  # not checked outside of the methods
+        self.assertRaises(ContractError, account.withdraw, 0)
+
+        class Savings(Account):
+            def add_interest(self, amount):
+                self.deposit(amount)
+                self.balance -= 3 * amount
+
+        savings = Savings(10)
+        self.assertRaises(ContractError, savings.add_interest, 'a')
+        self.assertRaises(ContractError, savings.add_interest, 10)
+
+        @contracts.contract_class(rate='recorded')
+        class Deposit(Account):
+            def set_rate(self, amount, rate):
+                pass
+
+        class FixedDeposit(Deposit):
+            def set_rate(self, amount, rate):
+                pass
+
+        self.assertRaises(ContractError, Deposit(1).set_rate, 1, -5)
+        self.assertRaises(ContractError, FixedDeposit(1).set_rate, 1, -5)
+        self.assertRaises(ContractError, FixedDeposit(1).set_rate, 'a', 5)
+        contracts.set_enabled(False)
+        try:
+            Account(-1)
+
+            @contracts.contract_class(_invariants=['balance:recorded'])
+            class Disabled(object):
+                def __init__(self, balance):
+                    self.balance = balance
+            Disabled(-1)
+        finally:
+            contracts.set_enabled(True)
+        self.assertRaises(ContractError, Account, -1)
+        self.assertRaises(ContractError, Disabled, -1)
+
+    def test_class_invariants_on_mutable_members(self):
+        new_contract('not empty', lambda x: len(x) > 0)
+
+        @contracts.contract_class(_invariants=['items:not empty', 'name:not empty'])
+        class Stack(object):
+            def __init__(self):
+                self.items = [1, 2]
+                self.name = 'stack'
+
+            def pop(self):
+                return self.items.pop()
+
+        stack = Stack()
+        self.assertEqual(stack.pop(), 2)
+        self.assertRaises(ContractError, stack.pop)
+        self.assertEqual(stack.__setattr__, object.__setattr__.__get__(stack))
+
+    def test_class_contract_redefined(self):
+        new_contract('small', lambda x: x < 10)
+
+        @contracts.contract_class(_invariants=['value:small'])
+        class Value(object):
+            def __init__(self):
+                self.value = 0
+
+            def set_value(self, value):
+                self.value = value
+
+        instance = Value()
+        instance.set_value(5)
+        new_contract('small', lambda x: x < 3)
+        self.assertRaises(ContractError, instance.set_value, 4)
+        instrumentation = contracts.set_instrumentation(True)
+        try:
+            instance.set_value(1)
+            self.assertEqual(instrumentation.contracts['small'].calls, 1)
+        finally:
+            contracts.set_instrumentation(False)
+
+    def test_streaming_parameter(self):
+        consumed = []
+
+        @contract(a='[int]')
+        def f(a, b=0):
+            for item in a:
+                consumed.append(item)
+            return b
+
+        def numbers(*items):
+            for item in items:
+                yield item
+
+        self.assertEqual(f(numbers(1, 2, 3), 1), 1)
+        self.assertEqual(consumed, [1, 2, 3])
+        del consumed[:]
+        with self.assertRaises(ContractError) as raised:
+            f(b=2, a=numbers(1, 'x', 3))
+        self.assertEqual(consumed, [1])
+        self.assertIn('item 1 of parameter a', str(raised.exception))
+        self.assertRaises(ContractError, f, 'abc')
+
+    def test_streaming_return_value(self):
+        @contract(_returns='[int]')
+        def f(items):
+            return (item for item in items)
+
+        self.assertEqual(list(f([1, 2])), [1, 2])
+        results = f([1, 2, 'x'])
+        self.assertEqual(next(results), 1)
+        self.assertEqual(next(results), 2)
+        with self.assertRaises(ContractError) as raised:
+            next(results)
+        self.assertIn('item 2 of return value', str(raised.exception))
+
     def test_string_list(self):
         """
         Special case: a string is a sequence; and therefore might still pass